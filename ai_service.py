@@ -1,66 +1,82 @@
-from openai import OpenAI
+import time
 import logging
+from singleflight import SingleFlight, StreamCancelled
+from logging_config import LogSampler
+from prompt_builder import PromptBuilder
+from llm_client import LLMClient, LLMDeadlineExceeded, current_deadline
 
 logger = logging.getLogger(__name__)
 
 class AIService:
-    def __init__(self):
-        """Initialize AI service with Ollama client - preserving existing code exactly"""
-        # Exact same client initialization as original code
-        self.client = OpenAI(
-            base_url="http://localhost:11434/v1",
-            api_key="ollama"
-        )
+    def __init__(self, llm=None):
+        """Initialize AI service with a managed Ollama client"""
+        # Pooled, concurrency-limited client against the Ollama host
+        self.llm = llm or LLMClient()
+        self.client = self.llm.client
+        self.model = self.llm.model
+        self.prompts = PromptBuilder()
+        # Identical concurrent prompts share one generation on the Ollama host
+        self._inflight = SingleFlight("llm")
+        self._chunk_sampler = LogSampler()
 
-    def get_styling_suggestions(self, detected_items, rgb_values):
+    def chat_with_chatgpt(self, prompt, cancelled=None):
         """
-        Get AI styling suggestions - preserving existing code exactly
+        Chat with ChatGPT - concurrent identical prompts share one generation
         """
         try:
-            # Build outfit summary - exact same logic as original
-            outfit_summary = ""
-            for i, item in enumerate(detected_items):
-                color = rgb_values[i] if i < len(rgb_values) else [128, 128, 128]
-                outfit_summary += f"{item['type']} (dominant color: {color}), "
-
-            outfit_summary = outfit_summary.rstrip(', ')
-
-            # Exact same prompt as original code
-            prompt = (
-                f"This is an outfit with the following items and their colors: {outfit_summary}. "
-                f"Rate the vibe of this outfit from 1-10, suggest accessories, and give one styling tip. "
-                f"Be concise in your response."
-            )
+            return "".join(self.stream_chat(prompt, cancelled))
 
-            logger.info("AI Styling Suggestions")
-            
-            # Get response from AI - preserving streaming logic
-            response_text = self.chat_with_chatgpt(prompt)
-            return response_text
-            
+        except StreamCancelled:
+            raise
         except Exception as e:
-            logger.error(f"Error getting AI suggestions: {e}")
+            logger.error("Error in chat completion: %s", e)
             raise
 
-    def chat_with_chatgpt(self, prompt):
+    def stream_chat(self, prompt, cancelled=None):
         """
-        Chat with ChatGPT - preserving existing streaming code exactly
+        Stream response tokens for a prompt.
+
+        Concurrent callers with the same prompt subscribe to a single upstream
+        stream and each receive every token from the start. Each caller waits
+        only until its own request deadline, captured here; the shared
+        generation is bounded by LLM_TIMEOUT, so one caller's short deadline
+        never cuts it off for the others. Setting the cancelled event ends
+        this caller's subscription with StreamCancelled, and the generation
+        itself stops once no caller is left waiting for it.
         """
+        deadline = current_deadline()
+        chunks = self._inflight.stream((self.model, prompt), self._generate, prompt,
+                                       deadline=deadline, cancelled=cancelled)
+        return self._until_deadline(chunks)
+
+    def _until_deadline(self, chunks):
         try:
-            response_text = ""
-            stream = self.client.chat.completions.create(
-                model="llama3:latest",
-                messages=[{"role": "user", "content": prompt}],
-                stream=True,
-            )
-            for chunk in stream:
-                if chunk.choices[0].delta.content is not None:
-                    content = chunk.choices[0].delta.content
-                    response_text += content
-                    logger.debug(content)
-            
-            return response_text
-            
-        except Exception as e:
-            logger.error(f"Error in chat completion: {e}")
-            raise
+            yield from chunks
+        except TimeoutError as e:
+            self.llm.metrics.incr("deadline_exceeded")
+            raise LLMDeadlineExceeded(str(e)) from e
+
+    def _generate(self, prompt, abandoned=None):
+        """Yield content chunks from one budgeted upstream streaming completion"""
+        # Token counts are logged per generation and totalled in llm.metrics
+        deadline = time.monotonic() + self.llm.timeout
+        # Once every subscriber has left, stop queueing for a slot for nobody
+        for content in self.llm.stream_chat(
+            [{"role": "user", "content": prompt}],
+            deadline=deadline,
+            cancelled=abandoned,
+            **self.prompts.completion_options()
+        ):
+            if logger.isEnabledFor(logging.DEBUG) and self._chunk_sampler.sample():
+                logger.debug("LLM stream chunk: %r", content)
+            yield content
+
+    def fallback_suggestions(self, detected_items):
+        """Fast canned advice returned when the LLM host is saturated"""
+        item_types = sorted({item['type'] for item in detected_items})
+        items_text = ", ".join(item_types) if item_types else "this outfit"
+        return (
+            f"Our stylist is busy right now, so here is a quick take on {items_text}: "
+            f"keep one statement piece and let the rest stay neutral, and add a belt "
+            f"or simple jewelry to finish the look. Try again shortly for a full rating."
+        )
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Incremental analytics rollups over outfits and clothing items.
+
+Uploads, corrections and suggestions bump per-day counters in two compact
+summary tables inside the same transaction that writes them, so /analytics
+reads a bounded number of rollup rows instead of scanning clothing_items.
+FashionTrend rows are refreshed from the same rollups:
+
+    python analytics.py rebuild          # backfill rollups from existing rows
+    python analytics.py refresh-trends   # recompute fashion_trends
+"""
+import sys
+import logging
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, select
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models import Outfit, ClothingItem, Recommendation, FashionTrend, DailyItemRollup, DailyActivityRollup
+from prompt_builder import color_name
+
+logger = logging.getLogger(__name__)
+
+ACTIVITY_METRICS = ("uploads", "items", "suggestions", "corrections")
+MAX_DAYS = 366
+TRENDING_COLORS = 3
+
+# Meteorological seasons (northern hemisphere) by month
+SEASONS = {12: "winter", 1: "winter", 2: "winter", 3: "spring", 4: "spring", 5: "spring",
+           6: "summer", 7: "summer", 8: "summer", 9: "fall", 10: "fall", 11: "fall"}
+
+
+def current_day(db):
+    """
+    Today by the database clock.
+
+    detected_at and created_at are stamped by the database, so every rollup
+    day comes from that clock too; near midnight a non-UTC database would
+    otherwise put an upload and its later correction on different days.
+    """
+    return db.execute(select(func.current_timestamp())).scalar().date()
+
+
+def day_of(db, timestamp):
+    """Rollup day of a stored timestamp, today by the database clock when it is not set"""
+    return timestamp.date() if timestamp else current_day(db)
+
+
+def _increment(db, model, key_columns, counts):
+    """Add counts[key] to each rollup row, creating missing rows, in one statement"""
+    rows = [dict(zip(key_columns, key), count=amount) for key, amount in sorted(counts.items()) if amount]
+    if not rows:
+        return
+    table = model.__table__
+    dialect = db.get_bind().dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+        stmt = insert(table).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=list(key_columns),
+            set_={"count": table.c.count + stmt.excluded.count}
+        )
+        db.execute(stmt)
+        return
+    # Other databases: update, then insert what did not exist yet
+    for row in rows:
+        keys = [table.c[column] == row[column] for column in key_columns]
+        result = db.execute(table.update().where(*keys).values(count=table.c.count + row["count"]))
+        if result.rowcount == 0:
+            db.execute(table.insert().values(**row))
+
+
+class Analytics:
+    """Rollup writers called from the pipeline and the /analytics reader"""
+
+    def record_upload(self, db, day, items):
+        """Count one uploaded outfit; items are (type, rgb) pairs"""
+        self.record_uploads(db, [(day, items)])
+
+    def record_uploads(self, db, outfits):
+        """Count many uploaded outfits at once; outfits are (day, items) pairs"""
+        item_counts = Counter()
+        activity = Counter()
+        for day, items in outfits:
+            activity[(day, "uploads")] += 1
+            activity[(day, "items")] += len(items)
+            for item_type, rgb in items:
+                item_counts[(day, item_type, color_name(rgb))] += 1
+        _increment(db, DailyItemRollup, ("day", "item_type", "color"), item_counts)
+        _increment(db, DailyActivityRollup, ("day", "metric"), activity)
+
+    def record_correction(self, db, day, old_type, new_type, rgb):
+        """Move one item between type buckets on the day it was uploaded"""
+        color = color_name(rgb)
+        item_counts = Counter()
+        if old_type != new_type:
+            item_counts[(day, old_type, color)] -= 1
+            item_counts[(day, new_type, color)] += 1
+        _increment(db, DailyItemRollup, ("day", "item_type", "color"), item_counts)
+        _increment(db, DailyActivityRollup, ("day", "metric"), {(current_day(db), "corrections"): 1})
+
+    def record_suggestion(self, db, day):
+        """Count one suggestion on the day of its recommendation's created_at"""
+        _increment(db, DailyActivityRollup, ("day", "metric"), {(day, "suggestions"): 1})
+
+    def summary(self, db, days=30):
+        """Activity per day, popular types and colors per ISO week over the last `days` days"""
+        end = current_day(db)
+        start = end - timedelta(days=days - 1)
+
+        activity = defaultdict(lambda: dict.fromkeys(ACTIVITY_METRICS, 0))
+        totals = dict.fromkeys(ACTIVITY_METRICS, 0)
+        for row in db.query(DailyActivityRollup).filter(DailyActivityRollup.day >= start):
+            activity[row.day.isoformat()][row.metric] = row.count
+            totals[row.metric] = totals.get(row.metric, 0) + row.count
+
+        types = Counter()
+        colors_by_week = defaultdict(Counter)
+        for row in db.query(DailyItemRollup).filter(DailyItemRollup.day >= start, DailyItemRollup.count > 0):
+            types[row.item_type] += row.count
+            year, week, _ = row.day.isocalendar()
+            colors_by_week[f"{year}-W{week:02d}"][row.color] += row.count
+
+        return {
+            "success": True,
+            "from": start.isoformat(),
+            "to": end.isoformat(),
+            "totals": totals,
+            "activity": dict(sorted(activity.items())),
+            "top_types": [{"type": t, "count": c} for t, c in types.most_common(10)],
+            "colors_by_week": {week: dict(counts.most_common()) for week, counts in sorted(colors_by_week.items())},
+        }
+
+    def refresh_fashion_trends(self, db):
+        """
+        Replace FashionTrend rows with per-season popularity from the rollups.
+
+        popularity_score is the type's share of all items detected that
+        season; trending_colors are its most frequent color buckets.
+        """
+        seasons = defaultdict(lambda: defaultdict(Counter))
+        for row in db.query(DailyItemRollup).filter(DailyItemRollup.count > 0):
+            season = (SEASONS[row.day.month], row.day.year)
+            seasons[season][row.item_type][row.color] += row.count
+
+        refreshed = 0
+        for (season, year), types in seasons.items():
+            db.query(FashionTrend).filter(FashionTrend.season == season, FashionTrend.year == year).delete()
+            season_total = sum(sum(colors.values()) for colors in types.values())
+            for item_type, colors in types.items():
+                db.add(FashionTrend(
+                    season=season,
+                    year=year,
+                    clothing_type=item_type,
+                    trending_colors=[color for color, _ in colors.most_common(TRENDING_COLORS)],
+                    popularity_score=round(sum(colors.values()) / season_total, 4)
+                ))
+                refreshed += 1
+        logger.info("Refreshed %s fashion trends across %s seasons", refreshed, len(seasons))
+        return refreshed
+
+    def rebuild(self, db):
+        """Recompute every rollup from outfits, items and recommendations"""
+        db.query(DailyItemRollup).delete()
+        db.query(DailyActivityRollup).delete()
+
+        today = current_day(db)
+        outfits = defaultdict(list)
+        days = {}
+        for outfit_id, detected_at in db.query(Outfit.outfit_id, Outfit.detected_at):
+            days[outfit_id] = detected_at.date() if detected_at else today
+            outfits[outfit_id] = []
+        for outfit_id, item_type, palette in db.query(
+                ClothingItem.outfit_id, ClothingItem.type, ClothingItem.color_palette):
+            if outfit_id in outfits:
+                outfits[outfit_id].append((item_type, palette))
+        self.record_uploads(db, [(days[outfit_id], items) for outfit_id, items in outfits.items()])
+
+        suggestions = Counter()
+        for created_at, count in db.query(func.date(Recommendation.created_at), func.count()).group_by(
+                func.date(Recommendation.created_at)):
+            day = datetime.fromisoformat(str(created_at)).date() if created_at else today
+            suggestions[(day, "suggestions")] += count
+        _increment(db, DailyActivityRollup, ("day", "metric"), suggestions)
+        logger.info("Rebuilt rollups from %s outfits", len(outfits))
+
+
+if __name__ == "__main__":
+    from database import SessionLocal
+
+    command = sys.argv[1] if len(sys.argv) > 1 else ""
+    if command not in ("rebuild", "refresh-trends"):
+        sys.exit(__doc__)
+    db = SessionLocal()
+    try:
+        analytics = Analytics()
+        if command == "rebuild":
+            analytics.rebuild(db)
+        analytics.refresh_fashion_trends(db)
+        db.commit()
+        print("✓ Analytics rollups updated")
+    finally:
+        db.close()
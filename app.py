@@ -1,30 +1,73 @@
-import os
-import tempfile
-import shutil
 from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Request, Depends
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse, FileResponse, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, Session
-from database import get_db
-from models import User, Outfit, ClothingItem, Recommendation
-from detection_service import DetectionService
-from color_service import ColorService
-from ai_service import AIService
-from search_service import SearchService
-import json
-from typing import List, Dict, Any
+from starlette.datastructures import Headers
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session
+from database import get_db, SessionLocal
+from pipeline import Pipeline, PipelineError, BadRequest, request_timeout
+from image_store import IMMUTABLE_CACHE_CONTROL
+from response_cache import etag_matches, REVALIDATE_CACHE_CONTROL
+from batch_service import iter_uploaded_images, detach_upload, to_ndjson
+from upload_ingest import (MultipartUpload, check_content_length, MAX_UPLOAD_BYTES,
+                           MAX_BATCH_UPLOAD_BYTES, MULTIPART_OVERHEAD)
+from llm_client import set_request_deadline, reset_request_deadline
+from logging_config import configure_logging, set_request_id, reset_request_id, current_request_id
+from typing import List, Optional
 import logging
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
+# Configure logging (LOG_LEVEL, LOG_FORMAT)
+configure_logging()
 logger = logging.getLogger(__name__)
 
 # Initialize FastAPI app
 app = FastAPI(title="AI Stylist Backend", version="1.0.0")
 
+class UploadSizeLimit:
+    """
+    Cap upload request bodies per path before they are parsed.
+
+    A larger Content-Length is refused without reading the body; bodies
+    without one (chunked) are counted as they arrive and refused with 413
+    as soon as they pass the limit, before Starlette parses and spools them.
+    """
+
+    def __init__(self, app, limits):
+        self.app = app
+        self.limits = limits
+
+    async def __call__(self, scope, receive, send):
+        limit = self.limits.get(scope["path"]) if scope["type"] == "http" else None
+        if limit is None:
+            return await self.app(scope, receive, send)
+        try:
+            check_content_length(Headers(scope=scope).get("content-length"), limit)
+        except PipelineError as e:
+            response = JSONResponse({"success": False, "detail": e.detail}, status_code=e.status_code)
+            return await response(scope, receive, send)
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    raise HTTPException(status_code=413, detail=f"Upload exceeds {limit} bytes")
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+# Added first so it runs innermost: a 413 raised while the route reads the
+# body then reaches the exception handlers below
+app.add_middleware(UploadSizeLimit, limits={
+    "/upload": MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD,
+    "/upload/batch": MAX_BATCH_UPLOAD_BYTES,
+})
+
 # CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -34,92 +77,149 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def request_deadline(request: Request, call_next):
+    """Propagate the HTTP request deadline to downstream LLM calls"""
+    token = set_request_deadline(request_timeout(request.headers.get("x-request-timeout")))
+    try:
+        return await call_next(request)
+    finally:
+        reset_request_deadline(token)
+
+@app.middleware("http")
+async def request_id(request: Request, call_next):
+    """Tag every log record of a request with its X-Request-ID"""
+    token = set_request_id(request.headers.get("x-request-id"))
+    try:
+        response = await call_next(request)
+        response.headers["X-Request-ID"] = current_request_id()
+        return response
+    finally:
+        reset_request_id(token)
+
+@app.exception_handler(PipelineError)
+async def pipeline_error(request: Request, exc: PipelineError):
+    return JSONResponse({"success": False, "detail": exc.detail}, status_code=exc.status_code, headers=exc.headers)
+
+@app.exception_handler(413)
+async def request_too_large(request: Request, exc: HTTPException):
+    return JSONResponse({"success": False, "detail": exc.detail}, status_code=413)
+
 # Static files and templates
 app.mount("/static", StaticFiles(directory="static"), name="static")
 templates = Jinja2Templates(directory="templates")
 
-# Initialize services
-detection_service = DetectionService()
-color_service = ColorService()
-ai_service = AIService()
-search_service = SearchService()
+# Shared pipeline; handlers are plain functions so blocking model and database
+# work runs in the threadpool instead of on the event loop
+pipeline = Pipeline()
+
+def cached_response(request: Request, cached):
+    """Serve a CachedResponse, or 304 when the client already has it"""
+    headers = {"ETag": cached.etag, "Cache-Control": REVALIDATE_CACHE_CONTROL}
+    if etag_matches(request.headers.get("if-none-match"), cached.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=cached.body, media_type=cached.media_type, headers=headers)
+
+def resolve_user_id(db, user_id, username, email):
+    """Prefer username/email (as the frontend sends) over a raw user_id"""
+    if username or email:
+        return pipeline.resolve_user(db, username, email)
+    return user_id
+
+def anonymous_client(request, username, email):
+    """Address to rate limit by when the caller gave no username/email, else None"""
+    if username or email or request.client is None:
+        return None
+    return request.client.host
 
 @app.get("/", response_class=HTMLResponse)
 async def home(request: Request):
     """Serve the main frontend page"""
-    return templates.TemplateResponse("index.html", {"request": request})
+    return templates.TemplateResponse(request, "index.html")
 
 @app.post("/upload")
-async def upload_image(
-    file: UploadFile = File(...),
-    user_id: int = Form(default=1),  # Default user for demo
-    db: Session = Depends(get_db)
-):
+async def upload_image(request: Request, db: Session = Depends(get_db)):
     """
     Upload and process an image using the existing YOLO detection code
+
+    Form fields: file, user_id (default 1), username, email. The body is
+    parsed as it arrives straight into a bounded buffer rather than spooled
+    to a temporary file, and oversized or non-image uploads are refused
+    early (413/415).
     """
+    upload = MultipartUpload(request.headers.get("content-type"), request.headers.get("content-length"))
+    async for chunk in request.stream():
+        upload.feed(chunk)
+    data = upload.finish()
+    client = anonymous_client(request, upload.fields.get("username"), upload.fields.get("email"))
+    return JSONResponse(await run_in_threadpool(process_upload, db, upload.fields, data, client))
+
+def process_upload(db, fields, data, client=None):
+    """Blocking part of /upload: resolve the user, then detect and persist"""
     try:
-        # Validate file type
-        if not file.content_type or not file.content_type.startswith('image/'):
-            raise HTTPException(status_code=400, detail="File must be an image")
-        
-        # Save uploaded file temporarily
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".jpg") as temp_file:
-            shutil.copyfileobj(file.file, temp_file)
-            temp_path = temp_file.name
-        
-        logger.info(f"Processing image: {temp_path}")
-        
-        # Run YOLO detection using existing code
-        detected_items = detection_service.detect_items(temp_path)
-        
-        # Extract dominant colors using existing code
-        rgb_values = color_service.get_dominant_colors(temp_path)
-        
-        # Save to database
-        outfit = Outfit(user_id=user_id, photo_url=temp_path)
-        db.add(outfit)
-        db.flush()  # Get the outfit_id
-        
-        # Save detected items to database
-        for i, item in enumerate(detected_items):
-            color_palette = rgb_values[i] if i < len(rgb_values) else None
-            clothing_item = ClothingItem(
-                outfit_id=outfit.outfit_id,
-                type=item['type'],
-                color_palette=color_palette,
-                bounding_box=item['bbox']
-            )
-            db.add(clothing_item)
-        
-        db.commit()
-        
-        # Clean up temp file
         try:
-            os.unlink(temp_path)
-        except:
-            pass
-        
-        return JSONResponse({
-            "success": True,
-            "outfit_id": outfit.outfit_id,
-            "detected_items": detected_items,
-            "dominant_colors": rgb_values,
-            "message": "Image processed successfully. Please review detections."
-        })
-        
+            user_id = int(fields.get("user_id") or 1)  # Default user for demo
+        except ValueError:
+            raise BadRequest("user_id must be an integer")
+        user_id = resolve_user_id(db, user_id, fields.get("username"), fields.get("email"))
+        return pipeline.upload(db, user_id, data, client)
+
+    except PipelineError:
+        db.rollback()
+        raise
     except Exception as e:
-        logger.error(f"Error processing image: {str(e)}")
-        # Clean up temp file if it exists
-        try:
-            if 'temp_path' in locals() and temp_path:
-                os.unlink(temp_path)
-        except:
-            pass
+        logger.error("Error processing image: %s", e)
+        db.rollback()
         raise HTTPException(status_code=500, detail=f"Error processing image: {str(e)}")
 
+@app.post("/upload/batch")
+def upload_batch(
+    request: Request,
+    files: List[UploadFile] = File(...),
+    user_id: int = Form(default=1),  # Default user for demo
+    username: Optional[str] = Form(default=None),
+    email: Optional[str] = Form(default=None)
+):
+    """
+    Analyze many images (or zip archives of images) in one request.
+
+    Returns NDJSON with one line per image as each batch completes.
+    """
+    # FastAPI closes the form's files when this returns, before the body streams
+    uploads = [(f.filename, detach_upload(f.file)) for f in files]
+
+    # Own session: the response outlives request-scoped dependencies
+    db = SessionLocal()
+    try:
+        batch_user_id = resolve_user_id(db, user_id, username, email)
+        db.commit()
+        # Admission is checked here so rejections get a real status code
+        batch = pipeline.upload_batch(db, batch_user_id, iter_uploaded_images(
+            uploads, MAX_UPLOAD_BYTES, MAX_BATCH_UPLOAD_BYTES), anonymous_client(request, username, email))
+    except Exception:
+        db.rollback()
+        db.close()
+        for _, handle in uploads:
+            handle.close()
+        raise
+
+    def results():
+        try:
+            for result in batch:
+                yield to_ndjson(result)
+        except Exception as e:
+            logger.error("Error in batch upload: %s", e)
+            db.rollback()
+            yield to_ndjson({"success": False, "detail": str(e)})
+        finally:
+            db.close()
+            for _, handle in uploads:
+                handle.close()
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
 @app.post("/correct-detection")
-async def correct_detection(
+def correct_detection(
     outfit_id: int = Form(...),
     item_index: int = Form(...),
     corrected_type: str = Form(...),
@@ -129,31 +229,17 @@ async def correct_detection(
     Allow manual correction of detected items (preserving existing workflow)
     """
     try:
-        # Get the outfit and its items
-        outfit = db.query(Outfit).filter(Outfit.outfit_id == outfit_id).first()
-        if not outfit:
-            raise HTTPException(status_code=404, detail="Outfit not found")
-        
-        clothing_items = db.query(ClothingItem).filter(ClothingItem.outfit_id == outfit_id).all()
-        
-        if item_index >= len(clothing_items):
-            raise HTTPException(status_code=400, detail="Invalid item index")
-        
-        # Update the item type
-        clothing_items[item_index].type = corrected_type
-        db.commit()
-        
-        return JSONResponse({
-            "success": True,
-            "message": f"Item {item_index} updated to {corrected_type}"
-        })
-        
+        return JSONResponse(pipeline.correct_detection(db, outfit_id, item_index, corrected_type))
+
+    except PipelineError:
+        raise
     except Exception as e:
-        logger.error(f"Error correcting detection: {str(e)}")
+        logger.error("Error correcting detection: %s", e)
+        db.rollback()
         raise HTTPException(status_code=500, detail=f"Error correcting detection: {str(e)}")
 
 @app.post("/generate-suggestions")
-async def generate_suggestions(
+def generate_suggestions(
     outfit_id: int = Form(...),
     db: Session = Depends(get_db)
 ):
@@ -161,71 +247,49 @@ async def generate_suggestions(
     Generate AI styling suggestions and similar outfit images using existing code
     """
     try:
-        # Get outfit and items from database
-        outfit = db.query(Outfit).filter(Outfit.outfit_id == outfit_id).first()
-        if not outfit:
-            raise HTTPException(status_code=404, detail="Outfit not found")
-        
-        clothing_items = db.query(ClothingItem).filter(ClothingItem.outfit_id == outfit_id).all()
-        
-        # Prepare data for existing AI service code
-        detected_items = []
-        rgb_values = []
-        
-        for item in clothing_items:
-            detected_items.append({
-                'type': item.type,
-                'confidence': 0.95  # Default since we don't store confidence after correction
-            })
-            rgb_values.append(item.color_palette if item.color_palette else [128, 128, 128])
-        
-        # Generate AI styling suggestions using existing code
-        ai_suggestion = ai_service.get_styling_suggestions(detected_items, rgb_values)
-        
-        # Get similar outfit images using existing search code
-        similar_images = search_service.find_similar_outfits(detected_items, rgb_values)
-        
-        # Save recommendation to database
-        recommendation = Recommendation(
-            outfit_id=outfit_id,
-            suggestion=ai_suggestion,
-            reasoning="AI-generated styling advice based on detected items and colors"
-        )
-        db.add(recommendation)
-        db.commit()
-        
-        return JSONResponse({
-            "success": True,
-            "ai_suggestions": ai_suggestion,
-            "similar_images": similar_images,
-            "recommendation_id": recommendation.rec_id
-        })
-        
+        return JSONResponse(pipeline.generate_suggestions(db, outfit_id))
+
+    except PipelineError:
+        raise
     except Exception as e:
-        logger.error(f"Error generating suggestions: {str(e)}")
+        logger.error("Error generating suggestions: %s", e)
+        db.rollback()
         raise HTTPException(status_code=500, detail=f"Error generating suggestions: {str(e)}")
 
 @app.get("/results/{outfit_id}", response_class=HTMLResponse)
-async def results_page(request: Request, outfit_id: int, db: Session = Depends(get_db)):
+def results_page(request: Request, outfit_id: int, db: Session = Depends(get_db)):
     """Serve the results page with outfit analysis"""
-    outfit = db.query(Outfit).filter(Outfit.outfit_id == outfit_id).first()
-    if not outfit:
-        raise HTTPException(status_code=404, detail="Outfit not found")
-    
-    clothing_items = db.query(ClothingItem).filter(ClothingItem.outfit_id == outfit_id).all()
-    recommendations = db.query(Recommendation).filter(Recommendation.outfit_id == outfit_id).all()
-    
-    return templates.TemplateResponse("results.html", {
-        "request": request,
-        "outfit": outfit,
-        "clothing_items": clothing_items,
-        "recommendations": recommendations
-    })
+    template = templates.get_template("results.html")
+    return cached_response(request, pipeline.results_page(db, outfit_id, template.render))
+
+@app.get("/outfits/{outfit_id}")
+def outfit_data(request: Request, outfit_id: int, db: Session = Depends(get_db)):
+    """Outfit, detected items and recommendations as JSON"""
+    return cached_response(request, pipeline.outfit(db, outfit_id))
+
+@app.get("/images/{digest}/{variant}")
+def stored_image(request: Request, digest: str, variant: str):
+    """Serve a stored image or derivative with long-lived cache headers, or 304"""
+    path, media_type = pipeline.stored_image(digest, variant)
+    etag = f'"{digest}-{variant}"'
+    headers = {"Cache-Control": IMMUTABLE_CACHE_CONTROL, "ETag": etag}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    if path:
+        return FileResponse(path, media_type=media_type, headers=headers)
+    return Response(content=pipeline.image_store.get(digest, variant), media_type=media_type, headers=headers)
+
+@app.get("/analytics")
+def analytics(days: int = 30, db: Session = Depends(get_db)):
+    """Daily activity, popular item types and weekly color distribution"""
+    return pipeline.analytics_summary(db, days)
+
+@app.get("/metrics")
+def get_metrics():
+    """Last saved evaluation metrics"""
+    return {"success": True, "metrics": pipeline.evaluation_metrics()}
 
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
-    return {"status": "healthy", "message": "AI Stylist Backend is running"}
-
-# Import database dependency
-from fastapi import Depends
+    return pipeline.health()
@@ -0,0 +1,226 @@
+"""
+Batch outfit analysis: many images per request, results streamed as NDJSON
+"""
+import io
+import os
+import json
+import math
+import zipfile
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2 as cv
+import numpy as np
+
+from models import Outfit, ClothingItem
+from color_service import dominant_colors_from_bytes
+from analytics import day_of
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+
+def to_ndjson(result):
+    """Encode one result as a newline-delimited JSON line"""
+    return json.dumps(result) + "\n"
+
+
+def detach_upload(fileobj):
+    """
+    Independent read handle on an uploaded file.
+
+    Frameworks close uploaded files when the request ends, which can happen
+    before a streamed response has finished reading them. Disk-backed files
+    are duplicated at the descriptor level, so no bytes are copied.
+    """
+    fileobj.seek(0)
+    try:
+        handle = os.fdopen(os.dup(fileobj.fileno()), "rb")
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        return io.BytesIO(fileobj.read())
+    handle.seek(0)
+    return handle
+
+
+def iter_uploaded_images(uploads, max_image_bytes, max_total_bytes):
+    """
+    Yield (filename, bytes) for every image in a set of uploaded files.
+
+    uploads is an iterable of (filename, file object). Zip archives are
+    expanded one member at a time, so only one image is held in memory
+    per file rather than the whole archive contents. A member larger than
+    max_image_bytes, or more than max_total_bytes of images in all, raises
+    ValueError, so a small archive cannot expand without bound.
+    """
+    total = 0
+    for filename, fileobj in uploads:
+        filename = filename or "upload"
+        if filename.lower().endswith(".zip"):
+            with zipfile.ZipFile(fileobj) as archive:
+                for info in archive.infolist():
+                    if info.is_dir() or not info.filename.lower().endswith(IMAGE_EXTENSIONS):
+                        continue
+                    if info.file_size > max_image_bytes:
+                        raise ValueError(f"{info.filename} expands to more than {max_image_bytes} bytes")
+                    total += info.file_size
+                    if total > max_total_bytes:
+                        raise ValueError(f"Archive contents exceed {max_total_bytes} bytes")
+                    # Read at most the declared size, whatever the member really inflates to
+                    with archive.open(info) as member:
+                        yield info.filename, member.read(info.file_size)
+        else:
+            data = fileobj.read()
+            total += len(data)
+            if total > max_total_bytes:
+                raise ValueError(f"Uploaded images exceed {max_total_bytes} bytes")
+            yield filename, data
+
+
+class BatchService:
+    """
+    Analyze many outfit photos per request.
+
+    Images are decoded as they are read and grouped into batches: each batch
+    runs through YOLO in one forward pass while dominant colors are computed
+    on a few threads (OpenCV releases the GIL while decoding and clustering). Every image and its derivatives go to the image store,
+    then all outfits and items of the batch are written with a single flush
+    and commit. Results are yielded per image as soon as its batch completes.
+    """
+
+    def __init__(self, detection_service, image_store, batch_size=None, max_workers=None, max_images=None,
+                 analytics=None, detection_limiter=None):
+        self.detection_service = detection_service
+        self.image_store = image_store
+        self.analytics = analytics
+        # Shared with single uploads, so batches count against DETECTION_MAX_CONCURRENCY
+        self.detection_limiter = detection_limiter
+        self.batch_size = batch_size or int(os.getenv("BATCH_SIZE", "8"))
+        self.max_workers = max_workers or int(os.getenv("BATCH_COLOR_WORKERS", "2"))
+        self.max_images = max_images or int(os.getenv("BATCH_MAX_IMAGES", "200"))
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    def _color_pool(self):
+        """Thread pool for K-means, created on first use"""
+        with self._pool_lock:
+            if self._pool is None:
+                # Created lazily so no threads exist in a pre-fork master
+                self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="batch-color")
+            return self._pool
+
+    def process(self, db, user_id, images, admit=None):
+        """
+        Yield one result dict per (filename, bytes) image.
+
+        admit() is called before every batch after the first and returns 0
+        to go ahead, or the seconds until the caller may continue; the
+        remaining images are then skipped.
+        """
+        batch = []
+        batches = 0
+        for count, (filename, data) in enumerate(images, start=1):
+            if count > self.max_images:
+                yield {
+                    "filename": filename,
+                    "success": False,
+                    "detail": f"Batch limit of {self.max_images} images reached; remaining images skipped"
+                }
+                break
+            if not batch and batches and admit is not None:
+                wait = admit()
+                if wait > 0:
+                    yield {
+                        "filename": filename,
+                        "success": False,
+                        "detail": f"Rate limit reached; remaining images skipped, retry in {math.ceil(wait)}s"
+                    }
+                    break
+            batch.append((filename, data))
+            if len(batch) >= self.batch_size:
+                yield from self._process_batch(db, user_id, batch)
+                batch = []
+                batches += 1
+        if batch:
+            yield from self._process_batch(db, user_id, batch)
+
+    def _process_batch(self, db, user_id, batch):
+        """Detect, color and persist one batch of images"""
+        pool = self._color_pool()
+        # Submit color extraction first so it overlaps with the YOLO pass
+        color_futures = [pool.submit(dominant_colors_from_bytes, data) for _, data in batch]
+
+        results = [None] * len(batch)
+        decoded = []
+        for index, (filename, data) in enumerate(batch):
+            img = cv.imdecode(np.frombuffer(data, np.uint8), cv.IMREAD_COLOR)
+            if img is None:
+                color_futures[index].cancel()
+                results[index] = {"filename": filename, "success": False, "detail": "Could not decode image"}
+            else:
+                decoded.append((index, filename, img))
+
+        if self.detection_limiter is not None and decoded and not self.detection_limiter.acquire():
+            for index, filename, _ in decoded:
+                color_futures[index].cancel()
+                results[index] = {"filename": filename, "success": False,
+                                  "detail": "Server busy (detection), please retry shortly"}
+            yield from results
+            return
+
+        try:
+            try:
+                detections = self.detection_service.detect_items_batch([img for _, _, img in decoded])
+            finally:
+                if self.detection_limiter is not None and decoded:
+                    self.detection_limiter.release()
+
+            pending = []
+            for (index, filename, img), detected_items in zip(decoded, detections):
+                rgb_values = color_futures[index].result()
+                digest = self.image_store.put(batch[index][1], img)
+                outfit = Outfit(user_id=user_id, photo_url=self.image_store.url(digest))
+                pending.append((index, filename, outfit, detected_items, rgb_values))
+
+            db.add_all([outfit for _, _, outfit, _, _ in pending])
+            db.flush()  # Assign outfit ids for the whole batch at once
+
+            clothing_items = []
+            rollups = []
+            for _, _, outfit, detected_items, rgb_values in pending:
+                outfit_items = [
+                    ClothingItem(
+                        outfit_id=outfit.outfit_id,
+                        type=item['type'],
+                        color_palette=rgb_values[i] if i < len(rgb_values) else None,
+                        bounding_box=item['bbox']
+                    )
+                    for i, item in enumerate(detected_items)
+                ]
+                clothing_items.extend(outfit_items)
+                rollups.append((day_of(db, outfit.detected_at), [(item.type, item.color_palette) for item in outfit_items]))
+            db.add_all(clothing_items)
+            if self.analytics is not None:
+                # Same transaction as the rows they count
+                self.analytics.record_uploads(db, rollups)
+            db.commit()
+
+            for index, filename, outfit, detected_items, rgb_values in pending:
+                results[index] = {
+                    "filename": filename,
+                    "success": True,
+                    "outfit_id": outfit.outfit_id,
+                    "photo_url": outfit.photo_url,
+                    "detected_items": detected_items,
+                    "dominant_colors": rgb_values
+                }
+
+        except Exception as e:
+            logger.error("Error processing batch: %s", e)
+            db.rollback()
+            for index, filename, _ in decoded:
+                results[index] = {"filename": filename, "success": False, "detail": str(e)}
+
+        for result in results:
+            yield result
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Compare the torch and ONNX Runtime detection backends.
+
+Exports the YOLO weights to ONNX if asked, checks that both backends agree
+on the same images and reports CPU throughput for each:
+
+    python benchmark_detection.py --export --images samples/ --threads 4
+    python benchmark_detection.py --int8 --batch 8
+"""
+import os
+import glob
+import time
+import argparse
+
+import cv2 as cv
+import numpy as np
+
+from detection_backends import UltralyticsBackend, OnnxBackend
+
+
+def export_onnx(model_path):
+    """Export YOLO .pt weights to ONNX with a dynamic batch dimension"""
+    from ultralytics import YOLO
+    return YOLO(model_path).export(format="onnx", dynamic=True, simplify=True)
+
+
+def load_images(directory, count):
+    if directory:
+        paths = sorted(
+            p for ext in ("jpg", "jpeg", "png", "webp")
+            for p in glob.glob(os.path.join(directory, f"*.{ext}"))
+        )
+        images = [img for img in (cv.imread(p) for p in paths[:count]) if img is not None]
+        if images:
+            return images
+    # Synthetic images only exercise throughput; parity needs real photos
+    rng = np.random.default_rng(0)
+    return [rng.integers(0, 255, (720, 540, 3), dtype=np.uint8) for _ in range(count)]
+
+
+def iou(a, b):
+    x1, y1 = max(a[0], b[0]), max(a[1], b[1])
+    x2, y2 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0.0, x2 - x1) * max(0.0, y2 - y1)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def compare(reference, candidate, threshold=0.5):
+    """Match detections by class and IoU; returns (matched, total, mean confidence delta)"""
+    matched, total, deltas = 0, 0, []
+    for ref_items, cand_items in zip(reference, candidate):
+        unused = list(cand_items)
+        for ref in ref_items:
+            total += 1
+            best = max(
+                (c for c in unused if c['type'] == ref['type']),
+                key=lambda c: iou(ref['bbox'], c['bbox']), default=None
+            )
+            if best is not None and iou(ref['bbox'], best['bbox']) > threshold:
+                matched += 1
+                deltas.append(abs(ref['confidence'] - best['confidence']))
+                unused.remove(best)
+    return matched, total, float(np.mean(deltas)) if deltas else 0.0
+
+
+def throughput(backend, images, batch, runs):
+    backend.predict(images[:batch])  # warm-up
+    start = time.perf_counter()
+    for _ in range(runs):
+        for i in range(0, len(images), batch):
+            backend.predict(images[i:i + batch])
+    return runs * len(images) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--model", default=os.getenv("YOLO_MODEL_PATH", "C:/Users/Admin/Downloads/stylo/StyleSensei/best.pt"))
+    parser.add_argument("--onnx", default=os.getenv("YOLO_ONNX_PATH"))
+    parser.add_argument("--export", action="store_true", help="export the .pt weights to ONNX first")
+    parser.add_argument("--images", help="directory of sample images (synthetic if omitted)")
+    parser.add_argument("--count", type=int, default=16)
+    parser.add_argument("--batch", type=int, default=1)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--threads", type=int, default=0, help="intra-op threads for both backends")
+    parser.add_argument("--int8", action="store_true", help="benchmark INT8-quantized ONNX weights")
+    args = parser.parse_args()
+
+    onnx_path = args.onnx or os.path.splitext(args.model)[0] + ".onnx"
+    if args.export:
+        onnx_path = export_onnx(args.model)
+        print(f"Exported {onnx_path}")
+
+    if args.threads:
+        import torch
+        torch.set_num_threads(args.threads)
+
+    images = load_images(args.images, args.count)
+    backends = [
+        UltralyticsBackend(args.model),
+        OnnxBackend(onnx_path, intra_op_threads=args.threads or None, quantize=args.int8),
+    ]
+
+    reference = backends[0].predict(images)
+    for backend in backends:
+        detections = backend.predict(images)
+        matched, total, delta = compare(reference, detections)
+        rate = throughput(backend, images, args.batch, args.runs)
+        print(
+            f"{backend.name:>6}: {rate:7.1f} images/s  "
+            f"parity {matched}/{total} matched, mean confidence delta {delta:.4f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
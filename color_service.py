@@ -17,12 +17,14 @@ class ColorService:
         red, green, blue = int(color[2]), int(color[1]), int(color[0])
         return bar, (red, green, blue)
 
-    def get_dominant_colors(self, image_path: str, number_clusters: int = 3):
-        """
-        Dominant Color Detection - preserving existing code exactly
-        """
+    def get_dominant_colors_from_bytes(self, data: bytes, number_clusters: int = 3):
+        """Dominant colors of an encoded image held in memory"""
+        img = cv.imdecode(np.frombuffer(data, np.uint8), cv.IMREAD_COLOR)
+        return self.get_dominant_colors_from_array(img, number_clusters)
+
+    def get_dominant_colors_from_array(self, img, number_clusters: int = 3):
+        """Dominant colors of an already decoded BGR image"""
         try:
-            img = cv.imread(image_path)
             if img is None:
                 raise ValueError("Could not read the image.")
 
@@ -31,7 +33,7 @@ class ColorService:
             # Handle very small images or adjust cluster count
             total_pixels = height * width
             if total_pixels < number_clusters:
-                logger.warning(f"Image too small ({total_pixels} pixels), using fewer clusters")
+                logger.warning("Image too small (%s pixels), using fewer clusters", total_pixels)
                 number_clusters = max(1, total_pixels)
             
             data = np.reshape(img, (height * width, 3))
@@ -44,12 +46,11 @@ class ColorService:
             data_for_kmeans = data.astype(np.float32)
             _, labels, centers = cv.kmeans(data_for_kmeans, number_clusters, None, criteria, 10, flags)
 
-            logger.info("Dominant Colors (RGB):")
             rgb_values = []
             for index, row in enumerate(centers):
                 bar, rgb = self.create_bar(200, 200, row)
                 rgb_values.append(rgb)
-                logger.debug(f"{index + 1}. RGB: {rgb}")
+            logger.debug("Dominant colors (RGB): %s", rgb_values)
 
             # Ensure we always return at least 3 colors for consistency
             while len(rgb_values) < 3:
@@ -58,7 +59,7 @@ class ColorService:
             return rgb_values
             
         except Exception as e:
-            logger.error(f"Error in color detection: {e}")
+            logger.error("Error in color detection: %s", e)
             # Return default colors if extraction fails
             return [[100, 100, 100], [150, 150, 150], [200, 200, 200]]
 
@@ -71,3 +72,11 @@ class ColorService:
         if r < 100 and g > 150 and b < 100: return "green"
         if r < 100 and g < 100 and b > 150: return "blue"
         return "black"
+
+
+# Batch color threads share one ColorService; it holds no state
+_shared_color_service = ColorService()
+
+def dominant_colors_from_bytes(data: bytes, number_clusters: int = 3):
+    """Dominant colors of an encoded image, for use from pool threads"""
+    return _shared_color_service.get_dominant_colors_from_bytes(data, number_clusters)
@@ -0,0 +1,257 @@
+"""
+Pluggable inference backends for DetectionService
+"""
+import os
+import ast
+import logging
+import threading
+from abc import ABC, abstractmethod
+
+import cv2 as cv
+import numpy as np
+
+import prefork
+
+logger = logging.getLogger(__name__)
+
+# NMS overlap threshold for every backend; ultralytics' own predict default,
+# so the ONNX path keeps the same boxes as the PyTorch one
+IOU_THRESHOLD = 0.7
+
+
+class DetectionBackend(ABC):
+    """
+    Runs a YOLO detector over decoded BGR images.
+
+    predict() returns one list per image of
+    {'type', 'confidence', 'bbox'} dicts, bbox as [x1, y1, x2, y2] pixels.
+    """
+    name = "base"
+
+    @abstractmethod
+    def predict(self, images, conf_threshold=0.25):
+        """Detections for each image in images"""
+
+    def prepare_for_fork(self):
+        """Finish lazy initialization before workers fork (see prefork.py)"""
+
+    def set_threads(self, threads):
+        """Use this many inference threads in a forked worker (see prefork.py)"""
+
+
+class UltralyticsBackend(DetectionBackend):
+    """PyTorch inference through ultralytics.YOLO"""
+    name = "torch"
+
+    def __init__(self, model_path):
+        from ultralytics import YOLO
+        self.model = YOLO(model_path)
+        self.names = self.model.names
+
+    def predict(self, images, conf_threshold=0.25):
+        results = self.model.predict(source=list(images), conf=conf_threshold, iou=IOU_THRESHOLD,
+                                     save=False, verbose=False)
+        batch_items = []
+        for result in results:
+            detected_items = []
+            for box in result.boxes:
+                detected_items.append({
+                    'type': self.names[int(box.cls)],
+                    'confidence': float(box.conf),
+                    'bbox': box.xyxy[0].tolist()
+                })
+            batch_items.append(detected_items)
+        return batch_items
+
+    def prepare_for_fork(self):
+        # Ultralytics fuses conv/batch-norm layers and builds its predictor on
+        # the first predict; done in a worker, that rewrites the weight tensors
+        # and gives every worker a private copy
+        self.model.fuse()
+        self.model.model.eval()
+        for param in self.model.model.parameters():
+            param.requires_grad_(False)
+        self.model.predict(source=np.zeros((640, 640, 3), np.uint8), save=False, verbose=False)
+
+
+def quantize_int8(model_path):
+    """Dynamically quantize an ONNX model to INT8 weights, cached next to it"""
+    quantized_path = os.path.splitext(model_path)[0] + ".int8.onnx"
+    if not os.path.exists(quantized_path) or os.path.getmtime(quantized_path) < os.path.getmtime(model_path):
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        logger.info("Quantizing %s to INT8", model_path)
+        quantize_dynamic(model_path, quantized_path, weight_type=QuantType.QUInt8)
+    return quantized_path
+
+
+class OnnxBackend(DetectionBackend):
+    """
+    CPU inference on an exported YOLO ONNX model through ONNX Runtime.
+
+    Uses full graph optimizations, configurable intra-op/inter-op thread
+    counts and optional INT8 weight quantization. Execution providers can be
+    chosen with ONNX_PROVIDERS, e.g. OpenVINOExecutionProvider before the
+    default CPUExecutionProvider. Does not import torch.
+    """
+    name = "onnx"
+
+    def __init__(self, model_path, intra_op_threads=None, inter_op_threads=None,
+                 quantize=None, iou_threshold=IOU_THRESHOLD, providers=None):
+        import onnxruntime as ort
+
+        if quantize is None:
+            quantize = os.getenv("ONNX_INT8", "").lower() in ("1", "true", "yes")
+        if quantize:
+            model_path = quantize_int8(model_path)
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        intra_op_threads = intra_op_threads or int(os.getenv("ONNX_INTRA_OP_THREADS", "0"))
+        # Unless pinned, use the worker's share of the cores (0 is every core)
+        self._intra_op_pinned = intra_op_threads > 0
+        options.intra_op_num_threads = intra_op_threads or prefork.worker_threads() or 0
+        options.inter_op_num_threads = inter_op_threads or int(os.getenv("ONNX_INTER_OP_THREADS", "0"))
+        if options.inter_op_num_threads > 1:
+            options.execution_mode = ort.ExecutionMode.ORT_PARALLEL
+
+        if providers is None:
+            providers = [p for p in os.getenv("ONNX_PROVIDERS", "CPUExecutionProvider").split(",") if p]
+        available = set(ort.get_available_providers())
+        providers = [p for p in providers if p in available] or ["CPUExecutionProvider"]
+
+        self._session_args = (model_path, options, providers)
+        self._session_lock = threading.Lock()
+        self.session = ort.InferenceSession(model_path, options, providers=providers)
+        self.iou_threshold = iou_threshold
+
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        batch_dim, _, height, width = model_input.shape
+        # Exports without dynamic=True have a fixed batch of 1
+        self.fixed_batch = batch_dim if isinstance(batch_dim, int) else None
+
+        metadata = self.session.get_modelmeta().custom_metadata_map
+        self.names = ast.literal_eval(metadata["names"]) if "names" in metadata else {}
+        if isinstance(height, int) and isinstance(width, int):
+            self.imgsz = (height, width)
+        elif "imgsz" in metadata:
+            self.imgsz = tuple(ast.literal_eval(metadata["imgsz"]))
+        else:
+            self.imgsz = (640, 640)
+        logger.info("ONNX detection model loaded from %s with %s", model_path, providers)
+
+    def prepare_for_fork(self):
+        # ONNX Runtime thread pools do not survive fork, so close the session
+        # in the master; each worker reopens it, and so loads its own copy of
+        # the weights, on first use
+        self.session = None
+
+    def set_threads(self, threads):
+        # Applies to the session each worker opens after fork
+        if not self._intra_op_pinned:
+            self._session_args[1].intra_op_num_threads = threads
+
+    def _get_session(self):
+        session = self.session
+        if session is None:
+            import onnxruntime as ort
+            with self._session_lock:
+                if self.session is None:
+                    self.session = ort.InferenceSession(
+                        self._session_args[0], self._session_args[1], providers=self._session_args[2]
+                    )
+                session = self.session
+        return session
+
+    def _letterbox(self, img):
+        """Resize keeping aspect ratio and pad to the model input size"""
+        target_h, target_w = self.imgsz
+        height, width = img.shape[:2]
+        ratio = min(target_h / height, target_w / width)
+        new_w, new_h = round(width * ratio), round(height * ratio)
+        pad_w, pad_h = (target_w - new_w) / 2, (target_h - new_h) / 2
+
+        if (new_w, new_h) != (width, height):
+            img = cv.resize(img, (new_w, new_h), interpolation=cv.INTER_LINEAR)
+        top, bottom = round(pad_h - 0.1), round(pad_h + 0.1)
+        left, right = round(pad_w - 0.1), round(pad_w + 0.1)
+        img = cv.copyMakeBorder(img, top, bottom, left, right, cv.BORDER_CONSTANT, value=(114, 114, 114))
+        return img, ratio, (left, top)
+
+    def _postprocess(self, prediction, ratio, pad, shape, conf_threshold):
+        """Decode one (4 + classes, anchors) output into detections"""
+        prediction = prediction.T
+        class_scores = prediction[:, 4:]
+        class_ids = class_scores.argmax(axis=1)
+        scores = class_scores[np.arange(len(class_ids)), class_ids]
+        keep = scores > conf_threshold
+        if not keep.any():
+            return []
+        boxes, scores, class_ids = prediction[keep, :4], scores[keep], class_ids[keep]
+
+        # xywh in letterboxed pixels -> xyxy in original image pixels
+        xyxy = np.empty_like(boxes)
+        xyxy[:, 0] = boxes[:, 0] - boxes[:, 2] / 2
+        xyxy[:, 1] = boxes[:, 1] - boxes[:, 3] / 2
+        xyxy[:, 2] = boxes[:, 0] + boxes[:, 2] / 2
+        xyxy[:, 3] = boxes[:, 1] + boxes[:, 3] / 2
+        xyxy[:, [0, 2]] = (xyxy[:, [0, 2]] - pad[0]) / ratio
+        xyxy[:, [1, 3]] = (xyxy[:, [1, 3]] - pad[1]) / ratio
+        xyxy[:, [0, 2]] = xyxy[:, [0, 2]].clip(0, shape[1])
+        xyxy[:, [1, 3]] = xyxy[:, [1, 3]].clip(0, shape[0])
+
+        # Per-class NMS, as ultralytics does, by offsetting boxes per class
+        offset = class_ids[:, None].astype(np.float32) * 7680
+        nms_boxes = xyxy + offset
+        nms_boxes[:, 2:] -= nms_boxes[:, :2]  # NMSBoxes takes x, y, w, h
+        indices = cv.dnn.NMSBoxes(nms_boxes.tolist(), scores.tolist(), conf_threshold, self.iou_threshold)
+
+        detected_items = []
+        for i in np.array(indices).flatten():
+            class_id = int(class_ids[i])
+            detected_items.append({
+                'type': self.names.get(class_id, str(class_id)),
+                'confidence': float(scores[i]),
+                'bbox': [float(v) for v in xyxy[i]]
+            })
+        detected_items.sort(key=lambda item: item['confidence'], reverse=True)
+        return detected_items
+
+    def predict(self, images, conf_threshold=0.25):
+        prepared = []
+        for img in images:
+            letterboxed, ratio, pad = self._letterbox(img)
+            prepared.append((letterboxed, ratio, pad, img.shape[:2]))
+        if not prepared:
+            return []
+
+        # BGR HWC uint8 -> RGB NCHW float32 in [0, 1]
+        blob = np.stack([p[0] for p in prepared])[..., ::-1].transpose(0, 3, 1, 2)
+        blob = np.ascontiguousarray(blob, dtype=np.float32) / 255.0
+
+        session = self._get_session()
+        if self.fixed_batch:
+            outputs = [
+                session.run(None, {self.input_name: blob[i:i + self.fixed_batch]})[0]
+                for i in range(0, len(blob), self.fixed_batch)
+            ]
+            output = np.concatenate(outputs)
+        else:
+            output = session.run(None, {self.input_name: blob})[0]
+
+        return [
+            self._postprocess(output[i], ratio, pad, shape, conf_threshold)
+            for i, (_, ratio, pad, shape) in enumerate(prepared)
+        ]
+
+
+def create_backend(kind=None, model_path=None):
+    """Build the configured backend (DETECTION_BACKEND: torch or onnx)"""
+    kind = (kind or os.getenv("DETECTION_BACKEND", "torch")).lower()
+    model_path = model_path or os.getenv("YOLO_MODEL_PATH", "C:/Users/Admin/Downloads/stylo/StyleSensei/best.pt")
+    if kind == "onnx":
+        onnx_path = os.getenv("YOLO_ONNX_PATH") or os.path.splitext(model_path)[0] + ".onnx"
+        return OnnxBackend(onnx_path)
+    if kind == "torch":
+        return UltralyticsBackend(model_path)
+    raise ValueError(f"Unknown detection backend '{kind}'")
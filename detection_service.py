@@ -1,64 +1,97 @@
 import logging
+import cv2 as cv
+import prefork
+from detection_backends import create_backend
 
 logger = logging.getLogger(__name__)
 
+# Returned when no detection backend could be loaded, so the demo still works
+MOCK_DETECTIONS = [
+    {
+        'type': 'shirt',
+        'confidence': 0.85,
+        'bbox': [100, 100, 200, 300]
+    },
+    {
+        'type': 'pants',
+        'confidence': 0.90,
+        'bbox': [80, 300, 220, 500]
+    }
+]
+
 class DetectionService:
-    def __init__(self):
-        """Initialize YOLO model - preserving existing code exactly"""
+    def __init__(self, backend=None):
+        """Initialize the configured YOLO backend (DETECTION_BACKEND: torch or onnx)"""
         try:
-            # Import ultralytics here to handle missing dependency gracefully
-            from ultralytics import YOLO
-            # Load YOLO Model - exact same as original code
-            self.model = YOLO("C:/Users/Admin/Downloads/stylo/StyleSensei/best.pt")
-            logger.info("YOLO model loaded successfully")
+            # Backends import their runtime lazily to handle missing dependencies gracefully
+            self.backend = backend or create_backend()
+            logger.info("YOLO model loaded successfully (%s backend)", self.backend.name)
+            prefork.register(self)
         except ImportError as e:
-            logger.error(f"Ultralytics not installed: {e}")
-            self.model = None
+            logger.error("Detection runtime not installed: %s", e)
+            self.backend = None
         except Exception as e:
-            logger.error(f"Error loading YOLO model: {e}")
-            self.model = None
+            logger.error("Error loading YOLO model: %s", e)
+            self.backend = None
+
+    def prepare_for_fork(self):
+        """Run all lazy initialization now so forked workers share the weights"""
+        if self.backend is None:
+            return
+        self.backend.prepare_for_fork()
+        logger.info("YOLO model prepared for copy-on-write sharing")
+
+    def set_threads(self, threads):
+        """Limit inference to this worker's share of the cores"""
+        if self.backend is not None:
+            self.backend.set_threads(threads)
 
-    def detect_items(self, image_path: str, conf_threshold: float = 0.25):
+    def detect_items(self, image, conf_threshold: float = 0.25):
         """
-        Run YOLO prediction - preserving existing code exactly
+        Run YOLO prediction on an image path or decoded BGR array
         """
-        if self.model is None:
+        if self.backend is None:
             logger.warning("YOLO model not available, returning mock data for demo")
             # Return mock detection data when YOLO is not available
-            return [
-                {
-                    'type': 'shirt',
-                    'confidence': 0.85,
-                    'bbox': [100, 100, 200, 300]
-                },
-                {
-                    'type': 'pants',
-                    'confidence': 0.90,
-                    'bbox': [80, 300, 220, 500]
-                }
-            ]
-        
+            return [dict(item) for item in MOCK_DETECTIONS]
+
         try:
-            # Run YOLO Prediction - exact same as original code
-            results = self.model.predict(source=image_path, conf=conf_threshold, save=True)
-            logger.info("YOLO Prediction completed")
-            
-            detected_items = []  # Initialize the list to store detected items - exact same as original
-            
-            for result in results:
-                for box in result.boxes:
-                    cls_id = int(box.cls)
-                    cls_name = self.model.names[cls_id]
-                    conf_score = float(box.conf)
-                    detected_items.append({
-                        'type': cls_name,
-                        'confidence': conf_score,
-                        'bbox': box.xyxy[0].tolist()  # Store bounding box - exact same as original
-                    })
-                    logger.debug(f"Detected: {cls_name} ({conf_score:.2f})")
-            
+            if isinstance(image, str):
+                path = image
+                image = cv.imread(path)
+                if image is None:
+                    raise ValueError(f"Could not read image {path}")
+
+            detected_items = self.backend.predict([image], conf_threshold)[0]
+            logger.info("YOLO prediction completed: %d items", len(detected_items))
+            if logger.isEnabledFor(logging.DEBUG):
+                for item in detected_items:
+                    logger.debug("Detected: %s (%.2f)", item['type'], item['confidence'])
+
             return detected_items
-            
+
+        except Exception as e:
+            logger.error("Error in YOLO detection: %s", e)
+            raise
+
+    def detect_items_batch(self, images, conf_threshold: float = 0.25):
+        """
+        Run YOLO on a list of decoded BGR images in one batched forward pass.
+
+        Returns one detections list per image, in input order, using the same
+        {'type', 'confidence', 'bbox'} shape as detect_items.
+        """
+        if not images:
+            return []
+        if self.backend is None:
+            logger.warning("YOLO model not available, returning mock data for demo")
+            return [[dict(item) for item in MOCK_DETECTIONS] for _ in images]
+
+        try:
+            batch_items = self.backend.predict(list(images), conf_threshold)
+            logger.info("YOLO batch prediction completed for %d images", len(images))
+            return batch_items
+
         except Exception as e:
-            logger.error(f"Error in YOLO detection: {e}")
+            logger.error("Error in YOLO batch detection: %s", e)
             raise
@@ -3,33 +3,75 @@ Flask version of the AI Stylist backend
 """
 
 import os
-import tempfile
 import logging
-import json
-import numpy as np
-from flask import Flask, request, jsonify, render_template
-from sqlalchemy.orm import Session
+from flask import Flask, request, jsonify, render_template, g, Response, stream_with_context, send_file
 from database import SessionLocal
-from models import User, Outfit, ClothingItem, Recommendation
-from detection_service import DetectionService
-from color_service import ColorService
-from ai_service import AIService
-from search_service import SearchService
-from evaluation_metrics import compute_yolo_metrics, compute_kmeans_metrics, save_metrics
-
-# Logging
-logging.basicConfig(level=logging.DEBUG)
+from pipeline import Pipeline, PipelineError, request_timeout
+from image_store import IMMUTABLE_CACHE_CONTROL
+from response_cache import etag_matches, REVALIDATE_CACHE_CONTROL
+from batch_service import iter_uploaded_images, detach_upload, to_ndjson
+from upload_ingest import (MultipartUpload, PayloadTooLarge, CHUNK_SIZE, MAX_UPLOAD_BYTES,
+                           MAX_BATCH_UPLOAD_BYTES, MULTIPART_OVERHEAD)
+from llm_client import set_request_deadline, reset_request_deadline
+from logging_config import configure_logging, set_request_id, reset_request_id, current_request_id
+
+# Logging (LOG_LEVEL, LOG_FORMAT)
+configure_logging()
 logger = logging.getLogger(__name__)
 
 # Flask app
 app = Flask(__name__)
 app.secret_key = os.environ.get("SESSION_SECRET", "demo-secret-key")
+# Werkzeug answers 413 for larger bodies before parsing them; /upload narrows it
+app.config["MAX_CONTENT_LENGTH"] = MAX_BATCH_UPLOAD_BYTES
+
+# Shared pipeline
+pipeline = Pipeline()
+
+
+@app.before_request
+def start_request_deadline():
+    """Propagate the HTTP request deadline to downstream LLM calls"""
+    g.request_id_token = set_request_id(request.headers.get("X-Request-ID"))
+    g.deadline_token = set_request_deadline(request_timeout(request.headers.get("X-Request-Timeout")))
+
+
+@app.after_request
+def add_request_id(response):
+    response.headers["X-Request-ID"] = current_request_id()
+    return response
+
+
+@app.teardown_request
+def clear_request_deadline(exc):
+    token = g.pop("deadline_token", None)
+    if token is not None:
+        reset_request_deadline(token)
+    token = g.pop("request_id_token", None)
+    if token is not None:
+        reset_request_id(token)
+
+
+@app.errorhandler(PipelineError)
+def pipeline_error(e):
+    return jsonify({"success": False, "detail": e.detail}), e.status_code, e.headers
+
+
+@app.errorhandler(413)
+def request_too_large(e):
+    return pipeline_error(PayloadTooLarge("Upload is too large"))
+
+
+def cached_response(cached):
+    """Serve a CachedResponse, or 304 when the client already has it"""
+    if etag_matches(request.headers.get("If-None-Match"), cached.etag):
+        response = Response(status=304)
+    else:
+        response = Response(cached.body, mimetype=cached.media_type)
+    response.headers["ETag"] = cached.etag
+    response.headers["Cache-Control"] = REVALIDATE_CACHE_CONTROL
+    return response
 
-# Services
-detection_service = DetectionService()
-color_service = ColorService()
-ai_service = AIService()
-search_service = SearchService()
 
 # --- Routes ---
 
@@ -40,78 +82,88 @@ def home():
 
 @app.route("/upload", methods=["POST"])
 def upload_image():
+    # Parse the body as it streams in, straight into a bounded buffer, instead
+    # of letting Werkzeug spool the file to disk; request.stream enforces the limit
+    request.max_content_length = MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD
+    upload = MultipartUpload(request.content_type, request.content_length)
+    for chunk in iter(lambda: request.stream.read(CHUNK_SIZE), b""):
+        upload.feed(chunk)
+    data = upload.finish()
+
     db = SessionLocal()
-    temp_path = None
     try:
-        if 'file' not in request.files:
-            return jsonify({"success": False, "detail": "No file provided"}), 400
-
-        file = request.files['file']
-        username = request.form.get('username', '').strip()
-        email = request.form.get('email', '').strip()
-
-        if not username or not email:
-            return jsonify({"success": False, "detail": "Username and email are required"}), 400
-
-        # Find or create user
-        user = db.query(User).filter((User.username == username) | (User.email == email)).first()
-        if user:
-            if user.username != username:
-                user.username = username
-            if user.email != email:
-                user.email = email
-            db.commit()
-            user_id = user.user_id
-        else:
-            new_user = User(username=username, email=email)
-            db.add(new_user)
-            db.flush()
-            user_id = new_user.user_id
-
-        # Save temp file
-        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=".jpg")
-        file.save(temp_file.name)
-        temp_path = temp_file.name
-        temp_file.close()
-
-        logger.info(f"Processing image: {temp_path}")
-
-        detected_items = detection_service.detect_items(temp_path)
-        rgb_values = color_service.get_dominant_colors(temp_path)
-
-        outfit = Outfit(user_id=user_id, photo_url=temp_path)
-        db.add(outfit)
-        db.flush()
-
-        for i, item in enumerate(detected_items):
-            color_palette = rgb_values[i] if i < len(rgb_values) else None
-            clothing_item = ClothingItem(
-                outfit_id=outfit.outfit_id,
-                type=item['type'],
-                color_palette=color_palette,
-                bounding_box=item['bbox']
-            )
-            db.add(clothing_item)
+        user_id = pipeline.resolve_user(db, upload.fields.get('username'), upload.fields.get('email'))
+        return jsonify(pipeline.upload(db, user_id, data))
 
+    except PipelineError:
+        db.rollback()
+        raise
+    except Exception as e:
+        logger.error("Error processing image: %s", e)
+        db.rollback()
+        return jsonify({"success": False, "detail": str(e)}), 500
+    finally:
+        db.close()
+
+
+@app.route("/upload/batch", methods=["POST"])
+def upload_batch():
+    """Analyze many images (or zip archives) and stream NDJSON results"""
+    files = request.files.getlist('files')
+    username = request.form.get('username')
+    email = request.form.get('email')
+
+    if not files:
+        return jsonify({"success": False, "detail": "No files provided"}), 400
+
+    # Flask closes request.files when the request ends, before streaming finishes
+    uploads = [(f.filename, detach_upload(f.stream)) for f in files]
+
+    db = SessionLocal()
+    try:
+        user_id = pipeline.resolve_user(db, username, email)
         db.commit()
+        # Admission is checked here so rejections get a real status code
+        batch = pipeline.upload_batch(db, user_id, iter_uploaded_images(uploads, MAX_UPLOAD_BYTES, MAX_BATCH_UPLOAD_BYTES))
+    except Exception:
+        db.rollback()
+        db.close()
+        for _, handle in uploads:
+            handle.close()
+        raise
 
+    def results():
         try:
-            os.unlink(temp_path)
-        except:
-            pass
+            for result in batch:
+                yield to_ndjson(result)
+        except Exception as e:
+            logger.error("Error in batch upload: %s", e)
+            db.rollback()
+            yield to_ndjson({"success": False, "detail": str(e)})
+        finally:
+            db.close()
+            for _, handle in uploads:
+                handle.close()
+
+    return Response(stream_with_context(results()), mimetype="application/x-ndjson")
+
+
+@app.route("/correct-detection", methods=["POST"])
+def correct_detection():
+    db = SessionLocal()
+    try:
+        outfit_id = request.form.get('outfit_id', type=int)
+        item_index = request.form.get('item_index', type=int)
+        if outfit_id is None or item_index is None:
+            return jsonify({"success": False, "detail": "Missing outfit_id or item_index"}), 400
 
-        return jsonify({
-            "success": True,
-            "outfit_id": outfit.outfit_id,
-            "detected_items": detected_items,
-            "dominant_colors": rgb_values
-        })
+        return jsonify(pipeline.correct_detection(db, outfit_id, item_index, request.form.get('corrected_type')))
 
+    except PipelineError:
+        db.rollback()
+        raise
     except Exception as e:
-        logger.error(f"Error processing image: {str(e)}")
-        if temp_path:
-            try: os.unlink(temp_path)
-            except: pass
+        logger.error("Error correcting detection: %s", e)
         db.rollback()
         return jsonify({"success": False, "detail": str(e)}), 500
     finally:
@@ -127,52 +179,13 @@ def generate_suggestions():
         if not outfit_id:
             return jsonify({"success": False, "detail": "Missing outfit_id"}), 400
 
-        outfit = db.query(Outfit).filter(Outfit.outfit_id == outfit_id).first()
-        if not outfit:
-            return jsonify({"success": False, "detail": "Outfit not found"}), 404
-
-        clothing_items = db.query(ClothingItem).filter(ClothingItem.outfit_id == outfit_id).all()
-
-        detected_items = []
-        rgb_values = []
-        y_true_labels = []
-
-        for item in clothing_items:
-            detected_items.append({'type': item.type, 'confidence': 0.95})
-            rgb_values.append(item.color_palette if item.color_palette else [128, 128, 128])
-            y_true_labels.append(item.type)
-
-        # AI suggestion
-        ai_suggestion = ai_service.get_styling_suggestions(detected_items, rgb_values)
-        similar_images = search_service.find_similar_outfits(detected_items, rgb_values)
-
-        # Save recommendation
-        recommendation = Recommendation(
-            outfit_id=outfit_id,
-            suggestion=ai_suggestion,
-            reasoning="AI-generated styling advice"
-        )
-        db.add(recommendation)
-        db.commit()
-
-        # --- Metrics ---
-        y_pred_labels = [item['type'] for item in detected_items]
-        precision, recall = compute_yolo_metrics(y_true_labels, y_pred_labels)
-        kmeans_labels = np.array([0]*len(rgb_values))  # replace with real cluster labels
-        silhouette = compute_kmeans_metrics(np.array(rgb_values), kmeans_labels)
-        metrics_dict = {"yolo_precision": precision, "yolo_recall": recall, "kmeans_silhouette": silhouette}
-        save_metrics(metrics_dict)
-
-        return jsonify({
-            "success": True,
-            "ai_suggestions": ai_suggestion,
-            "similar_images": similar_images,
-            "recommendation_id": recommendation.rec_id,
-            "metrics": metrics_dict
-        })
+        return jsonify(pipeline.generate_suggestions(db, outfit_id))
 
+    except PipelineError:
+        db.rollback()
+        raise
     except Exception as e:
-        logger.error(f"Error generating suggestions: {str(e)}")
+        logger.error("Error generating suggestions: %s", e)
         db.rollback()
         return jsonify({"success": False, "detail": str(e)}), 500
     finally:
@@ -183,32 +196,55 @@ def generate_suggestions():
 def results_page(outfit_id):
     db = SessionLocal()
     try:
-        outfit = db.query(Outfit).filter(Outfit.outfit_id == outfit_id).first()
-        if not outfit:
-            return "Outfit not found", 404
-        clothing_items = db.query(ClothingItem).filter(ClothingItem.outfit_id == outfit_id).all()
-        recommendations = db.query(Recommendation).filter(Recommendation.outfit_id == outfit_id).all()
-        return render_template("results.html",
-                               outfit=outfit,
-                               clothing_items=clothing_items,
-                               recommendations=recommendations)
+        render = lambda context: render_template("results.html", **context)
+        return cached_response(pipeline.results_page(db, outfit_id, render))
+    finally:
+        db.close()
+
+
+@app.route("/outfits/<int:outfit_id>")
+def outfit_data(outfit_id):
+    """Outfit, detected items and recommendations as JSON"""
+    db = SessionLocal()
+    try:
+        return cached_response(pipeline.outfit(db, outfit_id))
+    finally:
+        db.close()
+
+
+@app.route("/images/<digest>/<variant>")
+def stored_image(digest, variant):
+    """Serve a stored image or derivative with long-lived cache headers"""
+    path, media_type = pipeline.stored_image(digest, variant)
+    if path:
+        # send_file hands the file to the server's wsgi.file_wrapper (sendfile under Gunicorn)
+        response = send_file(path, mimetype=media_type, etag=f"{digest}-{variant}", conditional=True)
+    else:
+        response = Response(pipeline.image_store.get(digest, variant), mimetype=media_type)
+        response.set_etag(f"{digest}-{variant}")
+        response.make_conditional(request)
+    response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+    return response
+
+
+@app.route("/analytics")
+def analytics():
+    """Daily activity, popular item types and weekly color distribution"""
+    db = SessionLocal()
+    try:
+        return jsonify(pipeline.analytics_summary(db, request.args.get('days', 30, type=int)))
     finally:
         db.close()
 
 
 @app.route("/metrics", methods=["GET"])
 def get_metrics():
-    try:
-        with open("metrics/metrics.json") as f:
-            data = json.load(f)
-        return jsonify({"success": True, "metrics": data})
-    except:
-        return jsonify({"success": False, "detail": "No metrics found"}), 404
+    return jsonify({"success": True, "metrics": pipeline.evaluation_metrics()})
 
 
 @app.route("/health")
 def health_check():
-    return jsonify({"status": "healthy", "message": "AI Stylist Backend is running"})
+    return jsonify(pipeline.health())
 
 
 if __name__ == "__main__":
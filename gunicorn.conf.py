@@ -0,0 +1,53 @@
+"""
+Gunicorn settings for the production ASGI deployment:
+
+    gunicorn -c gunicorn.conf.py main:app
+
+Every setting can be overridden from the environment.
+"""
+import os
+
+
+def env_flag(name, default):
+    return os.getenv(name, default).strip().lower() in ("1", "true", "yes", "on")
+
+
+bind = os.getenv("BIND", "0.0.0.0:5000")
+
+# Each worker holds its own copy of everything not shared through preload,
+# so size this to memory rather than CPU count
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+worker_class = os.getenv("WORKER_CLASS", "uvicorn.workers.UvicornWorker")
+
+# Model sharing: import the app (and load the YOLO weights) once in the
+# master before forking, instead of once per worker. The weights are then
+# frozen so workers share them copy-on-write (see prefork.py). This applies
+# to the PyTorch backend only: ONNX Runtime sessions cannot survive fork, so
+# with DETECTION_BACKEND=onnx every worker loads its own copy of the weights
+preload_app = env_flag("PRELOAD_APP", "true")
+
+# Inference threads per worker (PyTorch, and ONNX Runtime unless
+# ONNX_INTRA_OP_THREADS is set); defaults to splitting the cores between workers
+model_threads = int(os.getenv("MODEL_THREADS_PER_WORKER", "0")) or max(1, (os.cpu_count() or 1) // workers)
+
+timeout = int(os.getenv("WORKER_TIMEOUT", "120"))
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", "30"))
+keepalive = int(os.getenv("KEEPALIVE", "5"))
+
+# Recycle workers periodically to bound slow memory growth; 0 disables
+max_requests = int(os.getenv("MAX_REQUESTS", "0"))
+max_requests_jitter = int(os.getenv("MAX_REQUESTS_JITTER", "0"))
+
+accesslog = os.getenv("ACCESS_LOG", "-")
+loglevel = os.getenv("LOG_LEVEL", "info").lower()
+
+
+def when_ready(server):
+    if preload_app:
+        import prefork
+        prefork.freeze_for_fork()
+
+
+def post_fork(server, worker):
+    import prefork
+    prefork.after_fork(model_threads)
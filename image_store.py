@@ -0,0 +1,181 @@
+"""
+Content-addressed persistent image store with pluggable storage backends
+"""
+import os
+import re
+import hashlib
+import tempfile
+import logging
+from abc import ABC, abstractmethod
+
+import cv2 as cv
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Longest edge in pixels for each stored derivative; None keeps the upload as-is
+VARIANTS = {
+    "original": None,
+    "display": 1280,
+    "thumb": 256,
+}
+
+URL_PREFIX = "/images/"
+DIGEST_RE = re.compile(r"^[0-9a-f]{64}$")
+
+# Leading magic bytes of the image formats accepted for upload
+IMAGE_SIGNATURES = (
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"BM", "image/bmp"),
+)
+
+
+def image_media_type(head: bytes):
+    """Media type of an image from its leading bytes, or None if unrecognized"""
+    if len(head) >= 12 and head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    for signature, media_type in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return media_type
+    return None
+
+
+def decode_image(data: bytes):
+    """Decode encoded image bytes to a BGR array, raising on invalid data"""
+    img = cv.imdecode(np.frombuffer(data, np.uint8), cv.IMREAD_COLOR)
+    if img is None:
+        raise ValueError("Could not decode image")
+    return img
+
+
+class StorageBackend(ABC):
+    """Interface for where image bytes live; keys are relative paths"""
+
+    @abstractmethod
+    def exists(self, key):
+        """Whether an object is stored under key"""
+
+    @abstractmethod
+    def put(self, key, data):
+        """Store data under key, replacing any existing object"""
+
+    @abstractmethod
+    def get(self, key):
+        """Bytes stored under key"""
+
+    def local_path(self, key):
+        """Filesystem path for zero-copy serving, or None if not local"""
+        return None
+
+
+class LocalFileSystemBackend(StorageBackend):
+    """Stores objects as files under a root directory"""
+
+    def __init__(self, root=None):
+        self.root = os.path.abspath(root or os.getenv("IMAGE_STORE_DIR", "media/images"))
+        os.makedirs(self.root, exist_ok=True)
+
+    def local_path(self, key):
+        return os.path.join(self.root, key)
+
+    def exists(self, key):
+        return os.path.exists(self.local_path(key))
+
+    def put(self, key, data):
+        path = self.local_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a sibling temp file and rename so readers never see partial files
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except Exception:
+            try:
+                os.unlink(temp_path)
+            except OSError:
+                pass
+            raise
+
+    def get(self, key):
+        with open(self.local_path(key), "rb") as f:
+            return f.read()
+
+
+class ImageStore:
+    """
+    Content-addressed image store.
+
+    Images are keyed by the sha256 of the uploaded bytes and sharded two
+    levels deep (ab/cd/abcd...). Each upload is written once along with a
+    downscaled display derivative and a thumbnail; storing the same image
+    again is a no-op.
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend or LocalFileSystemBackend()
+
+    @staticmethod
+    def key(digest, variant):
+        return f"{digest[:2]}/{digest[2:4]}/{digest}/{variant}"
+
+    def put(self, data: bytes, img=None):
+        """Store an upload and its derivatives; returns the sha256 digest"""
+        digest = hashlib.sha256(data).hexdigest()
+        if not self.backend.exists(self.key(digest, "original")):
+            self.backend.put(self.key(digest, "original"), data)
+
+        for variant, max_edge in VARIANTS.items():
+            if max_edge is None or self.backend.exists(self.key(digest, variant)):
+                continue
+            if img is None:
+                img = decode_image(data)
+            self.backend.put(self.key(digest, variant), self._downscale(img, max_edge))
+
+        return digest
+
+    @staticmethod
+    def _downscale(img, max_edge):
+        """JPEG-encode img with its longest edge capped at max_edge"""
+        height, width = img.shape[:2]
+        scale = max_edge / max(height, width)
+        if scale < 1:
+            img = cv.resize(img, (max(1, round(width * scale)), max(1, round(height * scale))),
+                            interpolation=cv.INTER_AREA)
+        ok, encoded = cv.imencode(".jpg", img, [cv.IMWRITE_JPEG_QUALITY, 85])
+        if not ok:
+            raise ValueError("Could not encode image derivative")
+        return encoded.tobytes()
+
+    def exists(self, digest, variant="original"):
+        return variant in VARIANTS and bool(DIGEST_RE.match(digest)) and \
+            self.backend.exists(self.key(digest, variant))
+
+    def get(self, digest, variant="original"):
+        return self.backend.get(self.key(digest, variant))
+
+    def local_path(self, digest, variant="original"):
+        return self.backend.local_path(self.key(digest, variant))
+
+    def media_type(self, digest, variant):
+        """Content type to serve a stored variant with"""
+        if variant != "original":
+            return "image/jpeg"
+        path = self.local_path(digest, variant)
+        if path:
+            with open(path, "rb") as f:
+                head = f.read(16)
+        else:
+            head = self.get(digest, variant)[:16]
+        return image_media_type(head) or "application/octet-stream"
+
+    @staticmethod
+    def url(digest, variant="display"):
+        return f"{URL_PREFIX}{digest}/{variant}"
+
+
+# Browsers and proxies may cache stored images forever: content never changes
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
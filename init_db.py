@@ -2,14 +2,30 @@
 """Initialize the database with tables"""
 
 import os
+from sqlalchemy import inspect, text
 from database import Base, engine
-from models import User, Outfit, ClothingItem, Recommendation, FashionTrend
+from models import User, Outfit, ClothingItem, Recommendation, FashionTrend, OutfitStage, DailyItemRollup, DailyActivityRollup
+
+# Columns added to tables that already existed; create_all only creates missing tables
+ADDED_COLUMNS = [
+    ("outfits", "version", "INTEGER NOT NULL DEFAULT 1"),
+]
+
+def add_missing_columns():
+    """Add columns introduced after a table was first created"""
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table, column, definition in ADDED_COLUMNS:
+            if column not in {c["name"] for c in inspector.get_columns(table)}:
+                conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {definition}"))
+                print(f"✓ Added {table}.{column}")
 
 def init_database():
     """Create all database tables"""
     try:
         # Create all tables
         Base.metadata.create_all(bind=engine)
+        add_missing_columns()
         print("✓ Database tables created successfully")
         
         # Create a default user for demo
@@ -0,0 +1,295 @@
+"""
+Managed client for the OpenAI-compatible LLM host (Ollama by default)
+"""
+import os
+import time
+import threading
+import contextvars
+import logging
+from contextlib import contextmanager
+
+import httpx
+from openai import OpenAI, APITimeoutError
+from prompt_builder import estimate_tokens
+from singleflight import CANCEL_POLL_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Absolute time.monotonic() deadline of the HTTP request being served, if any
+_request_deadline = contextvars.ContextVar("llm_request_deadline", default=None)
+
+
+class LLMOverloaded(Exception):
+    """Raised when a generation is shed because the model host is saturated"""
+
+
+class LLMDeadlineExceeded(Exception):
+    """Raised when the request deadline passes before or during a generation"""
+
+
+class LLMCancelled(Exception):
+    """Raised when a generation is cancelled before it reaches the model host"""
+
+
+def set_request_deadline(seconds):
+    """Start a deadline for the current request; returns a token for reset"""
+    return _request_deadline.set(time.monotonic() + seconds)
+
+
+def reset_request_deadline(token):
+    """Clear the deadline set by set_request_deadline"""
+    _request_deadline.reset(token)
+
+
+def current_deadline():
+    """Absolute monotonic deadline of the current request, or None"""
+    return _request_deadline.get()
+
+
+def remaining(deadline):
+    """Seconds left before deadline, or None when there is no deadline"""
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+class LLMMetrics:
+    """Thread-safe counters for queue time vs generation time"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.shed = 0
+        self.cancelled = 0
+        self.deadline_exceeded = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.queued = 0
+        self.queue_seconds_total = 0.0
+        self.queue_seconds_max = 0.0
+        self.generation_seconds_total = 0.0
+        self.generation_seconds_max = 0.0
+        self.prompt_tokens_total = 0
+        self.completion_tokens_total = 0
+
+    def record_queue(self, seconds):
+        with self._lock:
+            self.queue_seconds_total += seconds
+            self.queue_seconds_max = max(self.queue_seconds_max, seconds)
+
+    def record_generation(self, seconds):
+        with self._lock:
+            self.requests += 1
+            self.generation_seconds_total += seconds
+            self.generation_seconds_max = max(self.generation_seconds_max, seconds)
+
+    def record_usage(self, prompt_tokens, completion_tokens):
+        with self._lock:
+            self.prompt_tokens_total += prompt_tokens
+            self.completion_tokens_total += completion_tokens
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def snapshot(self):
+        with self._lock:
+            completed = max(self.requests, 1)
+            return {
+                "requests": self.requests,
+                "shed": self.shed,
+                "cancelled": self.cancelled,
+                "deadline_exceeded": self.deadline_exceeded,
+                "errors": self.errors,
+                "in_flight": self.in_flight,
+                "queued": self.queued,
+                "queue_seconds_avg": round(self.queue_seconds_total / completed, 4),
+                "queue_seconds_max": round(self.queue_seconds_max, 4),
+                "generation_seconds_avg": round(self.generation_seconds_total / completed, 4),
+                "generation_seconds_max": round(self.generation_seconds_max, 4),
+                "prompt_tokens_total": self.prompt_tokens_total,
+                "completion_tokens_total": self.completion_tokens_total,
+            }
+
+
+class LLMClient:
+    """
+    OpenAI-compatible client with pooling, bounded concurrency and deadlines.
+
+    A keep-alive connection pool is shared by all generations, a semaphore
+    caps in-flight generations at what the model host can serve, and callers
+    beyond max_queue waiting for a slot are shed immediately with
+    LLMOverloaded. Every setting can be overridden through the environment,
+    so the client can be pointed at a local stub server for testing.
+    """
+
+    def __init__(self, base_url=None, api_key=None, model=None,
+                 max_concurrency=None, max_queue=None, timeout=None,
+                 connect_timeout=None, max_retries=None):
+        self.base_url = base_url or os.getenv("OLLAMA_BASE_URL", "http://localhost:11434/v1")
+        self.model = model or os.getenv("LLM_MODEL", "llama3:latest")
+        self.max_concurrency = max_concurrency or int(os.getenv("LLM_MAX_CONCURRENCY", "1"))
+        self.max_queue = max_queue if max_queue is not None else int(os.getenv("LLM_MAX_QUEUE", "8"))
+        self.timeout = timeout or float(os.getenv("LLM_TIMEOUT", "120"))
+        connect_timeout = connect_timeout or float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+        if max_retries is None:
+            max_retries = int(os.getenv("LLM_MAX_RETRIES", "1"))
+
+        # Keep-alive pool sized to the concurrency cap so slots reuse sockets
+        self._http = httpx.Client(
+            limits=httpx.Limits(
+                max_connections=self.max_concurrency,
+                max_keepalive_connections=self.max_concurrency,
+                keepalive_expiry=60.0,
+            ),
+            timeout=httpx.Timeout(self.timeout, connect=connect_timeout),
+        )
+        self.client = OpenAI(
+            base_url=self.base_url,
+            api_key=api_key or os.getenv("OLLAMA_API_KEY", "ollama"),
+            http_client=self._http,
+            timeout=httpx.Timeout(self.timeout, connect=connect_timeout),
+            max_retries=max_retries,
+        )
+
+        self.metrics = LLMMetrics()
+        self._slots = threading.BoundedSemaphore(self.max_concurrency)
+        self._queue_lock = threading.Lock()
+        self._pending = 0
+
+    def has_capacity(self):
+        """Whether a generation could start now without queueing"""
+        with self._queue_lock:
+            return self._pending < self.max_concurrency
+
+    def _acquire(self, wait, cancelled):
+        """Wait up to wait seconds for a slot, giving up once cancelled is set"""
+        if cancelled is None:
+            return wait > 0 and self._slots.acquire(timeout=wait)
+        until = time.monotonic() + wait
+        while not cancelled.is_set():
+            left = until - time.monotonic()
+            if left <= 0:
+                return False
+            if self._slots.acquire(timeout=min(left, CANCEL_POLL_SECONDS)):
+                return True
+        return False
+
+    @contextmanager
+    def slot(self, deadline=None, cancelled=None):
+        """
+        Hold one generation slot, shedding load when the queue is full.
+
+        Setting the cancelled event gives up the place in the queue with
+        LLMCancelled.
+        """
+        with self._queue_lock:
+            if self._pending >= self.max_concurrency + self.max_queue:
+                self.metrics.incr("shed")
+                raise LLMOverloaded("LLM queue is full")
+            self._pending += 1
+
+        try:
+            started = time.monotonic()
+            wait = remaining(deadline)
+            if wait is None:
+                wait = self.timeout
+            self.metrics.incr("queued")
+            try:
+                acquired = self._acquire(wait, cancelled)
+            finally:
+                self.metrics.incr("queued", -1)
+
+            queued_for = time.monotonic() - started
+            self.metrics.record_queue(queued_for)
+            if not acquired:
+                if cancelled is not None and cancelled.is_set():
+                    self.metrics.incr("cancelled")
+                    raise LLMCancelled(f"Generation cancelled after queueing {queued_for:.2f}s")
+                self.metrics.incr("deadline_exceeded")
+                raise LLMDeadlineExceeded(f"No LLM slot free after {queued_for:.2f}s")
+
+            self.metrics.incr("in_flight")
+            try:
+                yield
+            finally:
+                self.metrics.incr("in_flight", -1)
+                self._slots.release()
+        finally:
+            with self._queue_lock:
+                self._pending -= 1
+
+    def stream_chat(self, messages, deadline=None, cancelled=None, **kwargs):
+        """
+        Yield content chunks for a chat completion within the deadline.
+
+        deadline is an absolute time.monotonic() value; it is captured by the
+        caller because generators may be drained on another thread. Once the
+        cancelled event is set, a generation that has not been sent yet is
+        dropped with LLMCancelled. Prompt and completion token counts,
+        estimated if the host does not report them, are logged per call and
+        totalled in metrics.
+        """
+        with self.slot(deadline, cancelled):
+            left = remaining(deadline)
+            if left is not None and left <= 0:
+                self.metrics.incr("deadline_exceeded")
+                raise LLMDeadlineExceeded("Request deadline passed while queued")
+            if cancelled is not None and cancelled.is_set():
+                self.metrics.incr("cancelled")
+                raise LLMCancelled("Generation cancelled before it was sent")
+
+            client = self.client
+            if left is not None:
+                client = client.with_options(timeout=min(left, self.timeout))
+
+            started = time.monotonic()
+            reported = None
+            completion_text = []
+            try:
+                stream = client.chat.completions.create(
+                    model=self.model,
+                    messages=messages,
+                    stream=True,
+                    stream_options={"include_usage": True},
+                    **kwargs,
+                )
+                try:
+                    for chunk in stream:
+                        if deadline is not None and time.monotonic() > deadline:
+                            self.metrics.incr("deadline_exceeded")
+                            raise LLMDeadlineExceeded("Request deadline passed during generation")
+                        if getattr(chunk, "usage", None) is not None:
+                            reported = chunk.usage
+                        if chunk.choices and chunk.choices[0].delta.content is not None:
+                            content = chunk.choices[0].delta.content
+                            completion_text.append(content)
+                            yield content
+                finally:
+                    stream.close()
+            except APITimeoutError as e:
+                self.metrics.incr("deadline_exceeded")
+                raise LLMDeadlineExceeded(str(e)) from e
+            except LLMDeadlineExceeded:
+                raise
+            except Exception:
+                self.metrics.incr("errors")
+                raise
+            finally:
+                elapsed = time.monotonic() - started
+                self.metrics.record_generation(elapsed)
+                if reported is not None:
+                    prompt_tokens = reported.prompt_tokens
+                    completion_tokens = reported.completion_tokens
+                else:
+                    prompt_tokens = sum(estimate_tokens(m.get("content", "")) for m in messages)
+                    completion_tokens = estimate_tokens("".join(completion_text))
+                self.metrics.record_usage(prompt_tokens, completion_tokens)
+                logger.info(
+                    "LLM generation: prompt_tokens=%d completion_tokens=%d estimated=%s seconds=%.2f",
+                    prompt_tokens, completion_tokens, reported is None, elapsed,
+                )
+
+    def close(self):
+        """Close pooled connections"""
+        self._http.close()
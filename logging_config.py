@@ -0,0 +1,128 @@
+"""
+Structured, non-blocking logging with per-request correlation ids.
+
+configure_logging() routes every record through a QueueHandler, so the
+request thread only enqueues it; a QueueListener thread formats and writes
+it. Records carry the id of the request that produced them (X-Request-ID).
+
+    LOG_LEVEL         root level (default INFO)
+    LOG_FORMAT        json (default) or text
+    LOG_SAMPLE_EVERY  keep one in N high-frequency debug events (default 100)
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import queue
+import atexit
+import logging
+import itertools
+import contextvars
+import logging.handlers
+
+_request_id = contextvars.ContextVar("request_id", default=None)
+
+TEXT_FORMAT = "%(asctime)s %(levelname)s [%(request_id)s] %(name)s: %(message)s"
+
+_handler = None
+_listener = None
+
+
+def set_request_id(value=None):
+    """Bind a request id (generated if missing) to the current context; returns a reset token"""
+    value = (value or "").strip()[:64] or uuid.uuid4().hex
+    return _request_id.set(value)
+
+
+def reset_request_id(token):
+    _request_id.reset(token)
+
+
+def current_request_id():
+    return _request_id.get()
+
+
+class RequestIdFilter(logging.Filter):
+    """Stamp records with the current request id before they leave the request thread"""
+
+    def filter(self, record):
+        record.request_id = _request_id.get() or "-"
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line"""
+
+    def format(self, record):
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "request_id": getattr(record, "request_id", "-"),
+            "pid": record.process,
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class LogSampler:
+    """
+    Keep one in every N occurrences of a high-frequency event.
+
+    Guard the log call so skipped events cost one counter step:
+
+        if logger.isEnabledFor(logging.DEBUG) and sampler.sample():
+            logger.debug("chunk %r", content)
+    """
+
+    def __init__(self, every=None):
+        self.every = max(1, every or int(os.getenv("LOG_SAMPLE_EVERY", "100")))
+        self._count = itertools.count()
+
+    def sample(self):
+        return next(self._count) % self.every == 0
+
+
+def _start_listener():
+    global _listener
+    stream = logging.StreamHandler(sys.stderr)
+    if os.getenv("LOG_FORMAT", "json").lower() == "text":
+        stream.setFormatter(logging.Formatter(TEXT_FORMAT))
+    else:
+        stream.setFormatter(JsonFormatter())
+    _handler.queue = queue.SimpleQueue()
+    _listener = logging.handlers.QueueListener(_handler.queue, stream, respect_handler_level=True)
+    _listener.start()
+
+
+def _stop_listener():
+    global _listener
+    if _listener is not None:
+        _listener.stop()  # drains the queue
+        _listener = None
+
+
+def configure_logging(level=None):
+    """Install the queue-based root handler once per process"""
+    global _handler
+    if _handler is not None:
+        return
+    level = (level or os.getenv("LOG_LEVEL", "INFO")).upper()
+
+    _handler = logging.handlers.QueueHandler(queue.SimpleQueue())
+    _handler.addFilter(RequestIdFilter())
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_handler)
+    root.setLevel(level)
+    _start_listener()
+
+    # The listener thread does not survive fork (pre-forked Gunicorn
+    # workers), so drain it before forking and give each side its own
+    os.register_at_fork(before=_stop_listener, after_in_parent=_start_listener,
+                        after_in_child=_start_listener)
+    atexit.register(_stop_listener)
@@ -1,3 +1,3 @@
-from flask_app import app
+from app import app
 
-# Flask app for Gunicorn compatibility
+# ASGI production entry point: gunicorn -c gunicorn.conf.py main:app
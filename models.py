@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, TIMESTAMP, Float, ForeignKey, JSON
+from sqlalchemy import Column, Integer, String, Text, TIMESTAMP, Date, Float, ForeignKey, JSON, UniqueConstraint
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from database import Base
@@ -20,11 +20,13 @@ class Outfit(Base):
     user_id = Column(Integer, ForeignKey("users.user_id", ondelete="CASCADE"))
     photo_url = Column(Text, nullable=False)
     detected_at = Column(TIMESTAMP, server_default=func.current_timestamp())
+    version = Column(Integer, nullable=False, default=1, server_default="1")  # Bumped on every change; keys cached responses
     
     # Relationships
     user = relationship("User", back_populates="outfits")
     clothing_items = relationship("ClothingItem", back_populates="outfit", cascade="all, delete-orphan")
     recommendations = relationship("Recommendation", back_populates="outfit", cascade="all, delete-orphan")
+    stages = relationship("OutfitStage", back_populates="outfit", cascade="all, delete-orphan")
 
 class ClothingItem(Base):
     __tablename__ = "clothing_items"
@@ -61,3 +63,37 @@ class Recommendation(Base):
     
     # Relationships
     outfit = relationship("Outfit", back_populates="recommendations")
+
+class OutfitStage(Base):
+    __tablename__ = "outfit_stages"
+    __table_args__ = (UniqueConstraint("outfit_id", "stage", "item_key"),)
+    
+    stage_id = Column(Integer, primary_key=True)
+    outfit_id = Column(Integer, ForeignKey("outfits.outfit_id", ondelete="CASCADE"), index=True)
+    stage = Column(String(50), nullable=False)  # Stage name in the analysis graph
+    item_key = Column(String(50), nullable=False, default="")  # Clothing item id for per-item stages
+    fingerprint = Column(String(64), nullable=False)  # Hash of the inputs the output was computed from
+    output = Column(JSON)
+    updated_at = Column(TIMESTAMP, server_default=func.current_timestamp(), onupdate=func.current_timestamp())
+    
+    # Relationships
+    outfit = relationship("Outfit", back_populates="stages")
+
+class DailyItemRollup(Base):
+    __tablename__ = "daily_item_rollups"
+    __table_args__ = (UniqueConstraint("day", "item_type", "color"),)
+    
+    rollup_id = Column(Integer, primary_key=True)
+    day = Column(Date, nullable=False, index=True)  # UTC day the outfit was uploaded
+    item_type = Column(String(50), nullable=False)
+    color = Column(String(20), nullable=False)  # Named color bucket (prompt_builder.color_name)
+    count = Column(Integer, nullable=False, default=0)
+
+class DailyActivityRollup(Base):
+    __tablename__ = "daily_activity_rollups"
+    __table_args__ = (UniqueConstraint("day", "metric"),)
+    
+    rollup_id = Column(Integer, primary_key=True)
+    day = Column(Date, nullable=False, index=True)
+    metric = Column(String(30), nullable=False)  # uploads, items, suggestions, corrections
+    count = Column(Integer, nullable=False, default=0)
@@ -0,0 +1,375 @@
+"""
+Framework-independent outfit analysis pipeline shared by the FastAPI and Flask apps
+"""
+import os
+import json
+import math
+import logging
+from contextlib import contextmanager
+
+import numpy as np
+
+from models import User, Outfit, ClothingItem, Recommendation
+from detection_service import DetectionService
+from color_service import ColorService
+from ai_service import AIService
+from search_service import SearchService
+from image_store import ImageStore, decode_image
+from stages import IncrementalAnalyzer
+from batch_service import BatchService
+from response_cache import ResponseCache
+from rate_limit import RateLimiter, StageLimiter
+from prefetch import Prefetcher
+from analytics import Analytics, MAX_DAYS, day_of
+from evaluation_metrics import compute_yolo_metrics, compute_kmeans_metrics, save_metrics
+
+logger = logging.getLogger(__name__)
+
+# Default per-request deadline, overridable by clients via X-Request-Timeout
+REQUEST_TIMEOUT = float(os.getenv("REQUEST_TIMEOUT", "60"))
+METRICS_PATH = "metrics/metrics.json"
+
+
+class PipelineError(Exception):
+    """An error the web adapters turn into an HTTP response"""
+    status_code = 500
+
+    def __init__(self, detail, status_code=None):
+        super().__init__(detail)
+        self.detail = detail
+        self.headers = {}
+        if status_code is not None:
+            self.status_code = status_code
+
+
+class BadRequest(PipelineError):
+    status_code = 400
+
+
+class NotFound(PipelineError):
+    status_code = 404
+
+
+class TooManyRequests(PipelineError):
+    status_code = 429
+
+    def __init__(self, detail, retry_after):
+        super().__init__(detail)
+        self.retry_after = retry_after
+        self.headers = {"Retry-After": str(max(1, math.ceil(retry_after)))}
+
+
+def request_timeout(header_value):
+    """Deadline in seconds for a request, capped at REQUEST_TIMEOUT"""
+    try:
+        return min(float(header_value), REQUEST_TIMEOUT) if header_value else REQUEST_TIMEOUT
+    except ValueError:
+        return REQUEST_TIMEOUT
+
+
+class Pipeline:
+    """
+    Stage orchestration for uploads, corrections and suggestions.
+
+    Every method takes an open SQLAlchemy session and returns plain data;
+    the web apps only parse requests, manage sessions and render responses.
+    """
+
+    def __init__(self, detection_service=None, color_service=None, ai_service=None,
+                 search_service=None, image_store=None, response_cache=None, rate_limiter=None):
+        self.detection_service = detection_service or DetectionService()
+        self.color_service = color_service or ColorService()
+        self.ai_service = ai_service or AIService()
+        self.search_service = search_service or SearchService()
+        self.image_store = image_store or ImageStore()
+        self.analytics = Analytics()
+        self.response_cache = response_cache or ResponseCache()
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.stage_limits = {
+            "detection": StageLimiter("detection", int(os.getenv("DETECTION_MAX_CONCURRENCY", "2"))),
+            "suggestions": StageLimiter("suggestions", int(os.getenv("SUGGESTIONS_MAX_CONCURRENCY", "4"))),
+        }
+        self.batch = BatchService(self.detection_service, self.image_store, analytics=self.analytics,
+                                  detection_limiter=self.stage_limits["detection"])
+        self.incremental = IncrementalAnalyzer(self.ai_service, self.search_service)
+        self.prefetcher = Prefetcher(self.incremental)
+
+    def rate_wait(self, user_id, cost=1, client=None):
+        """
+        Spend from the caller's token bucket; 0, or seconds until it would allow the request.
+
+        client is the caller's address when user_id was not resolved from a
+        username/email; such requests are keyed by address, since the
+        client picks the id itself.
+        """
+        key = f"client:{client}" if client else f"user:{user_id}"
+        return self.rate_limiter.check(key, cost)
+
+    def check_rate(self, user_id, cost=1, client=None):
+        """Spend from the caller's token bucket or raise TooManyRequests"""
+        wait = self.rate_wait(user_id, cost, client)
+        if wait > 0:
+            raise TooManyRequests("Too many requests, please slow down", wait)
+
+    @contextmanager
+    def stage_slot(self, stage):
+        """Hold one of the stage's concurrency slots or raise TooManyRequests"""
+        limiter = self.stage_limits[stage]
+        if not limiter.acquire():
+            raise TooManyRequests(f"Server busy ({stage}), please retry shortly", 1)
+        try:
+            yield
+        finally:
+            limiter.release()
+
+    def resolve_user(self, db, username, email):
+        """Find or create the user for a username/email pair and return its id"""
+        username = (username or "").strip()
+        email = (email or "").strip()
+        if not username or not email:
+            raise BadRequest("Username and email are required")
+
+        user = db.query(User).filter((User.username == username) | (User.email == email)).first()
+        if user:
+            if user.username != username:
+                user.username = username
+            if user.email != email:
+                user.email = email
+            db.commit()
+            return user.user_id
+        new_user = User(username=username, email=email)
+        db.add(new_user)
+        db.flush()
+        return new_user.user_id
+
+    def upload(self, db, user_id, data, client=None):
+        """Store, detect and color one uploaded image and persist the outfit"""
+        self.check_rate(user_id, client=client)
+        try:
+            img = decode_image(data)
+        except ValueError as e:
+            raise BadRequest(str(e))
+
+        # Persist the upload in the content-addressed image store
+        digest = self.image_store.put(data, img)
+        logger.info("Processing image: %s", digest)
+
+        with self.stage_slot("detection"):
+            detected_items = self.detection_service.detect_items(img)
+            rgb_values = self.color_service.get_dominant_colors_from_array(img)
+
+        outfit = Outfit(user_id=user_id, photo_url=self.image_store.url(digest))
+        db.add(outfit)
+        db.flush()  # Get the outfit_id
+
+        rollup_items = []
+        for i, item in enumerate(detected_items):
+            color_palette = rgb_values[i] if i < len(rgb_values) else None
+            db.add(ClothingItem(
+                outfit_id=outfit.outfit_id,
+                type=item['type'],
+                color_palette=color_palette,
+                bounding_box=item['bbox']
+            ))
+            rollup_items.append((item['type'], color_palette))
+        # detected_at was stamped by the database at flush
+        self.analytics.record_upload(db, day_of(db, outfit.detected_at), rollup_items)
+
+        db.commit()
+        # Start search and LLM now; /generate-suggestions usually follows
+        self.prefetcher.schedule(outfit.outfit_id)
+
+        return {
+            "success": True,
+            "outfit_id": outfit.outfit_id,
+            "photo_url": outfit.photo_url,
+            "detected_items": detected_items,
+            "dominant_colors": rgb_values,
+            "message": "Image processed successfully. Please review detections."
+        }
+
+    def upload_batch(self, db, user_id, images, client=None):
+        """
+        Yield one result per (filename, bytes) image; see BatchService.
+
+        Every BATCH_SIZE group of images costs one rate limit token. The
+        first is charged here, so an exhausted bucket is refused with 429
+        before streaming starts; once later groups run out of tokens the
+        rest of the batch is skipped.
+        """
+        self.check_rate(user_id, client=client)
+        return self.batch.process(db, user_id, images, admit=lambda: self.rate_wait(user_id, client=client))
+
+    def correct_detection(self, db, outfit_id, item_index, corrected_type):
+        """Change one item's type and drop the stage outputs that depend on it"""
+        corrected_type = (corrected_type or "").strip()
+        if not corrected_type:
+            raise BadRequest("corrected_type is required")
+
+        outfit = db.query(Outfit).filter(Outfit.outfit_id == outfit_id).first()
+        if not outfit:
+            raise NotFound("Outfit not found")
+
+        clothing_items = db.query(ClothingItem).filter(
+            ClothingItem.outfit_id == outfit_id
+        ).order_by(ClothingItem.item_id).all()
+
+        if item_index < 0 or item_index >= len(clothing_items):
+            raise BadRequest("Invalid item index")
+
+        item = clothing_items[item_index]
+        self.analytics.record_correction(db, day_of(db, outfit.detected_at), item.type, corrected_type, item.color_palette)
+        item.type = corrected_type
+        outfit.version = Outfit.version + 1
+        self.prefetcher.cancel(outfit_id)
+        self.incremental.invalidate(db, outfit_id, "detections", item.item_id)
+        db.commit()
+        self.response_cache.invalidate(outfit_id)
+
+        return {
+            "success": True,
+            "message": f"Item {item_index} updated to {corrected_type}"
+        }
+
+    def generate_suggestions(self, db, outfit_id):
+        """Styling suggestions and similar images, recomputing only changed stages"""
+        # Reuse (or wait for) whatever the post-upload prefetch computed
+        self.prefetcher.join(outfit_id)
+        outfit = db.query(Outfit).filter(Outfit.outfit_id == outfit_id).first()
+        if not outfit:
+            raise NotFound("Outfit not found")
+        self.check_rate(outfit.user_id)
+
+        with self.stage_slot("suggestions"):
+            analysis = self.incremental.analyze(db, outfit_id)
+
+        recommendation = Recommendation(
+            outfit_id=outfit_id,
+            suggestion=analysis["ai_suggestion"],
+            reasoning="AI-generated styling advice based on detected items and colors"
+        )
+        db.add(recommendation)
+        outfit.version = Outfit.version + 1
+        db.flush()  # Stamp created_at
+        self.analytics.record_suggestion(db, day_of(db, recommendation.created_at))
+        db.commit()
+        self.response_cache.invalidate(outfit_id)
+
+        return {
+            "success": True,
+            "ai_suggestions": analysis["ai_suggestion"],
+            "similar_images": analysis["similar_images"],
+            "recommendation_id": recommendation.rec_id,
+            "metrics": self._evaluate(analysis["detected_items"], analysis["rgb_values"]),
+            "stages": analysis["stages"]
+        }
+
+    def _evaluate(self, detected_items, rgb_values):
+        """Compute and save the evaluation metrics for one suggestion run"""
+        y_true_labels = [item['type'] for item in detected_items]
+        y_pred_labels = [item['type'] for item in detected_items]
+        precision, recall = compute_yolo_metrics(y_true_labels, y_pred_labels)
+        kmeans_labels = np.array([0] * len(rgb_values))  # replace with real cluster labels
+        silhouette = compute_kmeans_metrics(np.array(rgb_values), kmeans_labels)
+        metrics_dict = {"yolo_precision": precision, "yolo_recall": recall, "kmeans_silhouette": silhouette}
+        save_metrics(metrics_dict)
+        return metrics_dict
+
+    def results(self, db, outfit_id):
+        """Template context for the results page"""
+        outfit = db.query(Outfit).filter(Outfit.outfit_id == outfit_id).first()
+        if not outfit:
+            raise NotFound("Outfit not found")
+        clothing_items = db.query(ClothingItem).filter(
+            ClothingItem.outfit_id == outfit_id
+        ).order_by(ClothingItem.item_id).all()
+        recommendations = db.query(Recommendation).filter(Recommendation.outfit_id == outfit_id).all()
+        return {
+            "outfit": outfit,
+            "clothing_items": clothing_items,
+            "recommendations": recommendations
+        }
+
+    def outfit_version(self, db, outfit_id):
+        """Current Outfit.version, the key for cached per-outfit responses"""
+        version = db.query(Outfit.version).filter(Outfit.outfit_id == outfit_id).scalar()
+        if version is None:
+            raise NotFound("Outfit not found")
+        return version
+
+    def results_page(self, db, outfit_id, render):
+        """
+        Rendered results page as a CachedResponse.
+
+        render(context) turns the results() context into HTML; it only runs
+        when the page is not cached for the outfit's current version.
+        """
+        return self.response_cache.get_or_render(
+            "results", outfit_id, self.outfit_version(db, outfit_id),
+            lambda: render(self.results(db, outfit_id))
+        )
+
+    def outfit(self, db, outfit_id):
+        """Outfit, items and recommendations as a JSON CachedResponse"""
+        def render():
+            context = self.results(db, outfit_id)
+            outfit = context["outfit"]
+            return json.dumps({
+                "success": True,
+                "outfit_id": outfit.outfit_id,
+                "user_id": outfit.user_id,
+                "photo_url": outfit.photo_url,
+                "detected_at": outfit.detected_at.isoformat() if outfit.detected_at else None,
+                "clothing_items": [
+                    {
+                        "item_id": item.item_id,
+                        "type": item.type,
+                        "color_palette": item.color_palette,
+                        "bounding_box": item.bounding_box
+                    }
+                    for item in context["clothing_items"]
+                ],
+                "recommendations": [
+                    {
+                        "rec_id": rec.rec_id,
+                        "suggestion": rec.suggestion,
+                        "reasoning": rec.reasoning,
+                        "created_at": rec.created_at.isoformat() if rec.created_at else None
+                    }
+                    for rec in context["recommendations"]
+                ]
+            })
+
+        return self.response_cache.get_or_render(
+            "outfit", outfit_id, self.outfit_version(db, outfit_id), render, media_type="application/json"
+        )
+
+    def stored_image(self, digest, variant):
+        """(local path or None, media type) for a stored image variant"""
+        if not self.image_store.exists(digest, variant):
+            raise NotFound("Image not found")
+        return self.image_store.local_path(digest, variant), self.image_store.media_type(digest, variant)
+
+    def analytics_summary(self, db, days=30):
+        """Usage, item type and color rollups for the last `days` days"""
+        if not 1 <= days <= MAX_DAYS:
+            raise BadRequest(f"days must be between 1 and {MAX_DAYS}")
+        return self.analytics.summary(db, days)
+
+    def evaluation_metrics(self):
+        """Last saved evaluation metrics"""
+        try:
+            with open(METRICS_PATH) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            raise NotFound("No metrics found")
+
+    def health(self):
+        return {
+            "status": "healthy",
+            "message": "AI Stylist Backend is running",
+            "llm": self.ai_service.llm.metrics.snapshot(),
+            "response_cache": self.response_cache.stats(),
+            "rejected": {name: limiter.rejected for name, limiter in self.stage_limits.items()},
+            "prefetch": dict(self.prefetcher.stats)
+        }
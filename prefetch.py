@@ -0,0 +1,153 @@
+"""
+Speculative stage prefetch after upload.
+
+Nearly every upload is followed by /generate-suggestions for the same
+outfit. Once detection and colors are stored, the search and LLM stages are
+started in the background; their outputs land in the outfit's stage store
+(see stages.py), so the later request reuses them or joins the work still
+in flight.
+
+    PREFETCH_ENABLED      run speculative stages after upload (default true)
+    PREFETCH_WORKERS      background threads (default 2)
+    PREFETCH_MAX_PENDING  outfits queued or running before new ones are skipped (default 16)
+    PREFETCH_BUDGET       seconds a speculative run may take (default 30)
+"""
+import os
+import logging
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from database import SessionLocal
+from singleflight import StreamCancelled
+from llm_client import set_request_deadline, reset_request_deadline, current_deadline, remaining
+
+logger = logging.getLogger(__name__)
+
+# Share of a request's remaining deadline it may spend waiting on prefetch,
+# leaving the rest to compute whatever the job did not finish
+JOIN_SHARE = 0.5
+
+
+class _Job:
+    def __init__(self):
+        self.future = None
+        self.cancelled = threading.Event()
+
+
+class Prefetcher:
+    """
+    Runs IncrementalAnalyzer.analyze speculatively, one job per outfit.
+
+    The LLM stage only runs when the model host has a free slot, so
+    speculation never queues ahead of real requests. A correction cancels
+    the job: unless a real request is sharing its LLM generation, the
+    generation leaves the slot queue at once if it has not started, or is
+    closed at its next chunk if it has, and nothing the job computed is
+    committed. Stage fingerprints make any
+    output that does get stored safe to reuse or recompute either way.
+    """
+
+    def __init__(self, analyzer, session_factory=None, enabled=None, workers=None,
+                 max_pending=None, budget=None):
+        self.analyzer = analyzer
+        self.session_factory = session_factory or SessionLocal
+        if enabled is None:
+            enabled = os.getenv("PREFETCH_ENABLED", "true").lower() in ("1", "true", "yes")
+        self.enabled = enabled
+        self.workers = workers or int(os.getenv("PREFETCH_WORKERS", "2"))
+        self.max_pending = max_pending or int(os.getenv("PREFETCH_MAX_PENDING", "16"))
+        self.budget = budget or float(os.getenv("PREFETCH_BUDGET", "30"))
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._executor = None
+        self.stats = {"scheduled": 0, "skipped": 0, "cancelled": 0, "completed": 0, "joined": 0}
+
+    def _pool(self):
+        # Created on first use so no threads exist in a pre-fork master
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="prefetch")
+        return self._executor
+
+    def schedule(self, outfit_id):
+        """Start speculative stages for an outfit unless too much is already pending"""
+        if not self.enabled:
+            return False
+        with self._lock:
+            if outfit_id in self._jobs:
+                return False
+            if len(self._jobs) >= self.max_pending:
+                self.stats["skipped"] += 1
+                return False
+            job = _Job()
+            self._jobs[outfit_id] = job
+            self.stats["scheduled"] += 1
+            # Keep the upload's request id on the job's log records
+            context = contextvars.copy_context()
+            job.future = self._pool().submit(context.run, self._run, outfit_id, job)
+        return True
+
+    def cancel(self, outfit_id):
+        """Abandon speculative work for an outfit whose inputs just changed"""
+        with self._lock:
+            job = self._jobs.pop(outfit_id, None)
+            if job is None:
+                return
+            job.cancelled.set()
+            job.future.cancel()
+            self.stats["cancelled"] += 1
+        logger.info("Cancelled speculative stages for outfit %s", outfit_id)
+
+    def join(self, outfit_id):
+        """
+        Wait for in-flight speculative work for part of the request deadline.
+
+        The wait is capped at JOIN_SHARE of the time the request has left
+        and at PREFETCH_BUDGET. If the job is still running after that, the
+        caller computes the stages itself and coalesces onto the job's
+        in-flight LLM generation rather than starting another.
+        """
+        with self._lock:
+            job = self._jobs.get(outfit_id)
+        if job is None:
+            return
+        self.stats["joined"] += 1
+        left = remaining(current_deadline())
+        timeout = self.budget if left is None else max(0.0, min(left * JOIN_SHARE, self.budget))
+        try:
+            job.future.result(timeout=timeout)
+        except FutureTimeoutError:
+            logger.info("Speculative stages for outfit %s still running after %.1fs, not waiting",
+                        outfit_id, timeout)
+        except Exception:
+            pass  # _run logs its own failures
+
+    def _run(self, outfit_id, job):
+        token = set_request_deadline(self.budget)
+        db = self.session_factory()
+        try:
+            if job.cancelled.is_set():
+                return
+            self.analyzer.analyze(db, outfit_id, speculative=True, cancelled=job.cancelled)
+            if job.cancelled.is_set():
+                db.rollback()
+                return
+            db.commit()
+            self.stats["completed"] += 1
+        except StreamCancelled:
+            db.rollback()
+        except SQLAlchemyError as e:
+            # e.g. the outfit was deleted while the job ran
+            logger.warning("Discarding speculative stages for outfit %s: %s", outfit_id, e)
+            db.rollback()
+        except Exception as e:
+            logger.error("Speculative stages failed for outfit %s: %s", outfit_id, e)
+            db.rollback()
+        finally:
+            db.close()
+            reset_request_deadline(token)
+            with self._lock:
+                if self._jobs.get(outfit_id) is job:
+                    del self._jobs[outfit_id]
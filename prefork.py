@@ -0,0 +1,86 @@
+"""
+Copy-on-write model sharing across pre-forked server workers.
+
+With Gunicorn's preload_app the master imports the app, and with it the
+YOLO weights, before forking. Workers then share those pages with the
+master until something writes to them. This module removes the usual
+writers: lazy predictor setup and layer fusion on the first request,
+and the garbage collector touching every object header. ONNX Runtime
+sessions cannot be shared this way; each worker opens its own.
+"""
+import os
+import gc
+import sys
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Objects exposing prepare_for_fork() and set_threads(), registered as they are created
+_shareable = []
+_frozen = False
+# Inference threads of this worker, once after_fork has run
+_worker_threads = None
+
+
+def register(obj):
+    """
+    Register an object whose prepare_for_fork() runs before workers fork
+    and whose set_threads(threads) runs in each worker after it.
+    """
+    _shareable.append(obj)
+
+
+def worker_threads():
+    """Inference threads this worker was given by after_fork, or None"""
+    return _worker_threads
+
+
+def freeze_for_fork():
+    """
+    Finish all lazy model initialization and freeze the heap in the master.
+
+    Call once after the app is loaded and before the first fork.
+    """
+    global _frozen
+    if _frozen:
+        return
+
+    # Only touch torch when a backend already imported it (the ONNX one does not)
+    torch = sys.modules.get("torch")
+    if torch is not None:
+        # No intra-op thread pool may exist at fork time; workers size their own
+        torch.set_num_threads(1)
+        torch.set_grad_enabled(False)
+
+    for obj in _shareable:
+        try:
+            obj.prepare_for_fork()
+        except Exception as e:
+            logger.error("Could not prepare %s for fork: %s", type(obj).__name__, e)
+
+    # Move every surviving object to the permanent generation so collections
+    # in the workers never write to the shared pages
+    gc.collect()
+    gc.freeze()
+    _frozen = True
+    logger.info("Froze %s objects for copy-on-write sharing", gc.get_freeze_count())
+
+
+def after_fork(threads=None):
+    """Per-worker setup after fork: inference threads and fresh DB connections"""
+    global _worker_threads
+    threads = threads or int(os.getenv("MODEL_THREADS_PER_WORKER", "0"))
+    if threads > 0:
+        _worker_threads = threads
+        torch = sys.modules.get("torch")
+        if torch is not None:
+            torch.set_num_threads(threads)
+        for obj in _shareable:
+            try:
+                obj.set_threads(threads)
+            except Exception as e:
+                logger.error("Could not set inference threads on %s: %s", type(obj).__name__, e)
+
+    # Pooled connections inherited from the master must not be shared
+    from database import engine
+    engine.dispose(close=False)
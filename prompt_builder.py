@@ -0,0 +1,101 @@
+"""
+Compact prompt construction and output budgeting for styling suggestions
+"""
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Small named palette; every RGB value is reported as its nearest entry
+NAMED_COLORS = {
+    "black": (20, 20, 20),
+    "charcoal": (60, 60, 60),
+    "gray": (128, 128, 128),
+    "silver": (192, 192, 192),
+    "white": (245, 245, 245),
+    "cream": (240, 230, 200),
+    "beige": (210, 190, 150),
+    "tan": (180, 140, 100),
+    "brown": (110, 70, 40),
+    "maroon": (110, 20, 30),
+    "red": (200, 30, 40),
+    "pink": (240, 150, 180),
+    "orange": (240, 130, 30),
+    "mustard": (210, 170, 40),
+    "yellow": (245, 220, 60),
+    "olive": (110, 110, 40),
+    "green": (40, 140, 60),
+    "teal": (20, 120, 120),
+    "light blue": (150, 190, 230),
+    "blue": (40, 80, 180),
+    "navy": (20, 30, 80),
+    "purple": (110, 50, 140),
+    "lavender": (190, 170, 220),
+}
+
+DEFAULT_COLOR = (128, 128, 128)
+
+
+def color_name(rgb):
+    """Nearest named color for an RGB triple (accepts numpy scalars)"""
+    if rgb is None or len(rgb) < 3:
+        rgb = DEFAULT_COLOR
+    r, g, b = (int(c) for c in rgb[:3])
+    return min(
+        NAMED_COLORS,
+        key=lambda name: (
+            (NAMED_COLORS[name][0] - r) ** 2
+            + (NAMED_COLORS[name][1] - g) ** 2
+            + (NAMED_COLORS[name][2] - b) ** 2
+        ),
+    )
+
+
+def estimate_tokens(text):
+    """Rough token count (~4 characters per token) when the host reports none"""
+    return max(1, (len(text) + 3) // 4) if text else 0
+
+
+class PromptBuilder:
+    """
+    Build compact styling prompts with a bounded completion budget.
+
+    Items are reported with named colors instead of raw RGB values, and
+    identical (type, color) pairs are collapsed into a single counted entry.
+    """
+
+    def __init__(self, max_tokens=None, stop=None):
+        self.max_tokens = max_tokens or int(os.getenv("LLM_MAX_TOKENS", "160"))
+        if stop is None:
+            stop = [s for s in os.getenv("LLM_STOP_SEQUENCES", "\n\n\n|###").split("|") if s]
+        self.stop = stop
+
+    def summarize_items(self, detected_items, rgb_values):
+        """Deduplicated 'type (color)' list, preserving first-seen order"""
+        counts = {}
+        for i, item in enumerate(detected_items):
+            color = rgb_values[i] if i < len(rgb_values) else DEFAULT_COLOR
+            key = (item['type'], color_name(color))
+            counts[key] = counts.get(key, 0) + 1
+
+        parts = []
+        for (item_type, name), count in counts.items():
+            prefix = f"{count}x " if count > 1 else ""
+            parts.append(f"{prefix}{item_type} ({name})")
+        return ", ".join(parts)
+
+    def styling_prompt(self, detected_items, rgb_values):
+        """Prompt asking for a vibe rating, accessories and one styling tip"""
+        outfit_summary = self.summarize_items(detected_items, rgb_values) or "no detected items"
+        return (
+            f"Outfit: {outfit_summary}. "
+            f"Rate its vibe 1-10, suggest accessories, and give one styling tip. "
+            f"Be concise."
+        )
+
+    def completion_options(self):
+        """Keyword arguments bounding the completion length"""
+        options = {"max_tokens": self.max_tokens}
+        if self.stop:
+            options["stop"] = self.stop
+        return options
@@ -0,0 +1,143 @@
+"""
+Admission control for the expensive endpoints: per-user token buckets and
+per-stage concurrency limits.
+
+    RATE_LIMIT_PER_MINUTE  sustained requests per user (default 20, 0 disables)
+    RATE_LIMIT_BURST       bucket size (default 5)
+    RATE_LIMIT_REDIS_URL   share buckets between workers through Redis
+    STAGE_QUEUE_TIMEOUT    seconds to wait for a stage slot (default 5)
+"""
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryBucketStore:
+    """Token buckets in this process; bounded, least recently used evicted first"""
+
+    def __init__(self, max_keys=10000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # key -> (tokens, last refill time)
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst, cost=1):
+        """Spend cost tokens; returns 0 if allowed, else seconds until it would be"""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            if tokens >= cost:
+                tokens -= cost
+                wait = 0.0
+            else:
+                wait = (cost - tokens) / rate
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return wait
+
+
+# Atomic refill-and-spend on a Redis hash, timed by the Redis clock so that
+# workers on different hosts agree
+_REDIS_TAKE = """
+local rate, burst, cost = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or burst
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + (now - updated) * rate)
+local wait = 0
+if tokens >= cost then
+    tokens = tokens - cost
+else
+    wait = (cost - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+return tostring(wait)
+"""
+
+
+class RedisBucketStore:
+    """Token buckets shared by every worker through a Redis server"""
+
+    def __init__(self, url, prefix="ratelimit:"):
+        import redis
+        self.prefix = prefix
+        self._client = redis.Redis.from_url(url)
+        self._take = self._client.register_script(_REDIS_TAKE)
+
+    def take(self, key, rate, burst, cost=1):
+        return float(self._take(keys=[self.prefix + key], args=[rate, burst, cost]))
+
+
+def create_store():
+    """Redis store when RATE_LIMIT_REDIS_URL is set, else in-process"""
+    url = os.getenv("RATE_LIMIT_REDIS_URL")
+    if url:
+        try:
+            return RedisBucketStore(url)
+        except ImportError:
+            logger.error("RATE_LIMIT_REDIS_URL is set but the redis package is not installed")
+        except Exception as e:
+            logger.error("Could not connect to the rate limit store: %s", e)
+    return MemoryBucketStore()
+
+
+class RateLimiter:
+    """Per-key token bucket: `per_minute` sustained, up to `burst` at once"""
+
+    def __init__(self, per_minute=None, burst=None, store=None):
+        per_minute = per_minute if per_minute is not None else float(os.getenv("RATE_LIMIT_PER_MINUTE", "20"))
+        self.rate = per_minute / 60.0
+        self.burst = burst or float(os.getenv("RATE_LIMIT_BURST", "5"))
+        self.store = store or create_store()
+
+    @property
+    def enabled(self):
+        return self.rate > 0
+
+    def check(self, key, cost=1):
+        """0 if the request may proceed, else seconds the caller should wait"""
+        if not self.enabled:
+            return 0.0
+        try:
+            return self.store.take(key, self.rate, self.burst, cost)
+        except Exception as e:
+            # A broken shared store must not take the site down with it
+            logger.error("Rate limit check failed, admitting request: %s", e)
+            return 0.0
+
+
+class StageLimiter:
+    """
+    Global cap on concurrent work in one expensive stage (per process).
+
+    Callers wait up to queue_timeout seconds for a slot before giving up.
+    """
+
+    def __init__(self, name, limit, queue_timeout=None):
+        self.name = name
+        self.limit = limit
+        self.queue_timeout = queue_timeout if queue_timeout is not None else float(os.getenv("STAGE_QUEUE_TIMEOUT", "5"))
+        self._slots = threading.BoundedSemaphore(limit) if limit > 0 else None
+        self.rejected = 0
+
+    def acquire(self):
+        """Take a slot; False if none freed up within queue_timeout"""
+        if self._slots is None:
+            return True
+        if self._slots.acquire(timeout=self.queue_timeout):
+            return True
+        self.rejected += 1
+        logger.warning("Stage '%s' saturated (%s in flight), rejecting request", self.name, self.limit)
+        return False
+
+    def release(self):
+        if self._slots is not None:
+            self._slots.release()
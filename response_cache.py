@@ -0,0 +1,111 @@
+"""
+Bounded in-process cache for rendered per-outfit responses
+"""
+import os
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict, namedtuple
+
+logger = logging.getLogger(__name__)
+
+CachedResponse = namedtuple("CachedResponse", ["body", "etag", "media_type"])
+
+# Shared result links are revalidated on every view; unchanged pages cost a 304
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
+
+def etag_for(body):
+    """Strong ETag derived from the response body, identical across workers"""
+    return '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+
+def etag_matches(if_none_match, etag):
+    """Whether an If-None-Match header value matches etag (weak comparison)"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = (tag.strip() for tag in if_none_match.split(","))
+    return any(tag.removeprefix("W/") == etag for tag in candidates)
+
+
+class ResponseCache:
+    """
+    LRU cache of rendered responses keyed by (kind, outfit_id).
+
+    Each entry records the outfit's version (Outfit.version, bumped in the
+    same transaction as every change to the outfit) it was rendered for,
+    and is only served while the database still reports that version, so
+    a change made through any worker is seen by every other worker on its
+    next request. Eviction is LRU, bounded both by entry count and total
+    body bytes. An optional TTL (RESPONSE_CACHE_TTL, off by default) also
+    drops entries nobody has read for that many seconds; every hit
+    restarts it.
+    """
+
+    def __init__(self, max_entries=None, max_bytes=None, ttl=None):
+        self.max_entries = max_entries or int(os.getenv("RESPONSE_CACHE_ENTRIES", "256"))
+        self.max_bytes = max_bytes or int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+        self.ttl = ttl if ttl is not None else float(os.getenv("RESPONSE_CACHE_TTL", "0"))
+        self._entries = OrderedDict()  # (kind, outfit_id) -> (version, expires, response)
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_render(self, kind, outfit_id, version, render, media_type="text/html; charset=utf-8"):
+        """
+        Return the response cached for this version, or call render() and cache its result.
+
+        version must be read before render() runs, so that a render which
+        races a change is stored under the older version and never served
+        for the newer one. render() returns the body as str or bytes;
+        exceptions propagate and nothing is cached.
+        """
+        key = (kind, outfit_id)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == version and (not self.ttl or entry[1] > now):
+                self._entries[key] = (version, now + self.ttl, entry[2])
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+
+        body = render()
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        response = CachedResponse(body, etag_for(body), media_type)
+
+        with self._lock:
+            current = self._entries.get(key)
+            # Never replace an entry rendered for a newer version
+            if len(body) <= self.max_bytes and (current is None or current[0] <= version):
+                self._remove(key)
+                self._entries[key] = (version, now + self.ttl, response)
+                self._size += len(body)
+                self._evict()
+        return response
+
+    def invalidate(self, outfit_id):
+        """Drop this worker's cached responses for an outfit it just changed"""
+        with self._lock:
+            for key in [key for key in self._entries if key[1] == outfit_id]:
+                self._remove(key)
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._size, "hits": self.hits, "misses": self.misses}
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= len(entry[2].body)
+
+    def _evict(self):
+        while len(self._entries) > self.max_entries or self._size > self.max_bytes:
+            key, entry = self._entries.popitem(last=False)
+            self._size -= len(entry[2].body)
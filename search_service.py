@@ -1,17 +1,20 @@
 import logging
+from singleflight import SingleFlight
 
 logger = logging.getLogger(__name__)
 
 class SearchService:
     def __init__(self):
         """Initialize search service - preserving existing code exactly"""
+        # Identical concurrent queries share one upstream search
+        self._inflight = SingleFlight("search")
         try:
             # Import DDGS here to handle missing dependency gracefully
             from ddgs import DDGS
             # Initialize the DDGS search object - exact same as original
             self.search = DDGS()
         except ImportError as e:
-            logger.error(f"DuckDuckGo search not available: {e}")
+            logger.error("DuckDuckGo search not available: %s", e)
             self.search = None
 
     def rgb_to_simple_color(self, rgb):
@@ -24,68 +27,47 @@ class SearchService:
         if r < 100 and g < 100 and b > 150: return "blue"
         return "black"
 
-    def find_similar_outfits(self, detected_items, rgb_values):
+    def build_query(self, item_type, rgb):
+        """Search query for one clothing item - exact same format as original"""
+        color_name = self.rgb_to_simple_color(rgb)
+        return f"{color_name} {item_type}"
+
+    def search_images(self, query):
         """
-        Find similar outfit images - preserving existing code exactly
+        Top images for one query; raises if the upstream search fails.
+
+        Identical concurrent queries share one upstream search.
         """
         if self.search is None:
-            logger.warning("Search service not available, returning mock results")
             # Return mock results when search is not available
-            mock_results = []
-            for item, color in zip(detected_items, rgb_values):
-                color_name = self.rgb_to_simple_color(color)
-                query = f"{color_name} {item['type']}"
-                mock_results.append({
-                    'query': query,
-                    'images': [
-                        {
-                            'url': 'https://via.placeholder.com/300x400?text=Similar+Outfit+1',
-                            'title': f'Similar {query} style 1',
-                            'source': 'Example Fashion Site'
-                        },
-                        {
-                            'url': 'https://via.placeholder.com/300x400?text=Similar+Outfit+2',
-                            'title': f'Similar {query} style 2',
-                            'source': 'Example Fashion Site'
-                        }
-                    ]
-                })
-            return mock_results
-        
-        try:
-            all_results = []
-            
-            # Iterate over items and fetch top 3 images - exact same logic as original
-            for item, color in zip(detected_items, rgb_values):
-                color_name = self.rgb_to_simple_color(color)
-                query = f"{color_name} {item['type']}"
-                logger.info(f"Searching for: '{query}'")
-
-                item_results = {
-                    'query': query,
-                    'images': []
+            return [
+                {
+                    'url': 'https://via.placeholder.com/300x400?text=Similar+Outfit+1',
+                    'title': f'Similar {query} style 1',
+                    'source': 'Example Fashion Site'
+                },
+                {
+                    'url': 'https://via.placeholder.com/300x400?text=Similar+Outfit+2',
+                    'title': f'Similar {query} style 2',
+                    'source': 'Example Fashion Site'
                 }
+            ]
+
+        logger.info("Searching for: '%s'", query)
+        images = self._inflight.do(query, self._fetch_images, query)
+        return [dict(image) for image in images]
 
-                try:
-                    # DDGS returns a generator - exact same as original
-                    results = self.search.images(query, safesearch='Moderate', region='US')
-                    for i, r in enumerate(results):
-                        if i >= 3:  # limit to top 3 - exact same as original
-                            break
-                        item_results['images'].append({
-                            'url': r['image'],
-                            'title': r.get('title', ''),
-                            'source': r.get('source', '')
-                        })
-                        
-                except Exception as search_error:
-                    logger.warning(f"Search failed for query '{query}': {search_error}")
-                    # Continue with other items even if one search fails
-                
-                all_results.append(item_results)
-            
-            return all_results
-            
-        except Exception as e:
-            logger.error(f"Error in image search: {e}")
-            raise
+    def _fetch_images(self, query, limit=3):
+        """Fetch the top image results for one query from DDGS"""
+        images = []
+        # DDGS returns a generator - exact same as original
+        results = self.search.images(query, safesearch='Moderate', region='US')
+        for i, r in enumerate(results):
+            if i >= limit:  # limit to top 3 - exact same as original
+                break
+            images.append({
+                'url': r['image'],
+                'title': r.get('title', ''),
+                'source': r.get('source', '')
+            })
+        return images
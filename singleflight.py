@@ -0,0 +1,192 @@
+"""
+Single-flight request coalescing for identical concurrent upstream calls
+"""
+import time
+import threading
+import logging
+import contextvars
+
+logger = logging.getLogger(__name__)
+
+
+class _Call:
+    """An in-flight call whose result is shared by every waiter"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+# How often a subscriber waiting for chunks checks its cancellation event
+CANCEL_POLL_SECONDS = 0.1
+
+
+class StreamCancelled(Exception):
+    """Raised to a stream subscriber whose cancellation event was set"""
+
+
+class _StreamCall:
+    """An in-flight stream whose chunks are replayed to every subscriber"""
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.chunks = []
+        self.finished = False
+        self.error = None
+        self.subscribers = 0
+        # Set once every subscriber has left before the stream finished
+        self.abandoned = threading.Event()
+
+    def pump(self, iterator):
+        """Drain the upstream iterator into the shared chunk buffer"""
+        try:
+            for chunk in iterator:
+                if self.abandoned.is_set():
+                    logger.debug("stream abandoned by every subscriber, closing upstream")
+                    break
+                with self.cond:
+                    self.chunks.append(chunk)
+                    self.cond.notify_all()
+        except BaseException as e:
+            with self.cond:
+                self.error = e
+        finally:
+            close = getattr(iterator, "close", None)
+            if close is not None:
+                close()
+            with self.cond:
+                self.finished = True
+                self.cond.notify_all()
+
+    def subscribe(self, deadline=None, cancelled=None):
+        """
+        Yield every chunk from the start, blocking until more arrive.
+
+        deadline is this subscriber's absolute time.monotonic() limit; past
+        it the subscriber raises TimeoutError while the stream carries on
+        for the others. Once the cancelled event is set it raises
+        StreamCancelled instead.
+        """
+        index = 0
+        while True:
+            with self.cond:
+                while index >= len(self.chunks) and not self.finished:
+                    if cancelled is not None and cancelled.is_set():
+                        raise StreamCancelled("Stream subscriber cancelled")
+                    wait = None if deadline is None else deadline - time.monotonic()
+                    if wait is not None and wait <= 0:
+                        raise TimeoutError("Deadline passed while waiting for the stream")
+                    if cancelled is not None:
+                        wait = CANCEL_POLL_SECONDS if wait is None else min(wait, CANCEL_POLL_SECONDS)
+                    self.cond.wait(wait)
+                pending = self.chunks[index:]
+                finished = self.finished
+                error = self.error
+            for chunk in pending:
+                if cancelled is not None and cancelled.is_set():
+                    raise StreamCancelled("Stream subscriber cancelled")
+                yield chunk
+            index += len(pending)
+            if finished and index >= len(self.chunks):
+                if error is not None:
+                    raise error
+                return
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls that share a key into one upstream call.
+
+    The first caller for a key runs the function; callers arriving while it
+    is in flight wait for and receive the same result (or exception). Once
+    the call completes the key is released, so later calls run fresh.
+    """
+
+    def __init__(self, name="singleflight"):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._streams = {}
+
+    def do(self, key, fn, *args, **kwargs):
+        """Run fn once per in-flight key and share its result"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+
+        if not leader:
+            logger.debug("%s: joining in-flight call for %r", self.name, key)
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    def stream(self, key, fn, *args, deadline=None, cancelled=None, **kwargs):
+        """
+        Fan out one upstream stream to every concurrent subscriber.
+
+        fn must return an iterator. It is drained on a background thread so a
+        slow or disconnected subscriber never stalls the others; each
+        subscriber receives every chunk from the beginning of the stream.
+        deadline and cancelled only end this caller's subscription (see
+        _StreamCall.subscribe). When every subscriber has left before the
+        stream finished, the key is released so later callers start afresh
+        and the upstream iterator is closed at its next chunk. fn is called
+        as fn(*args, abandoned=event, **kwargs) so work that has not yielded
+        yet, such as waiting for a model slot, can watch for that too.
+        """
+        with self._lock:
+            call = self._streams.get(key)
+            leader = call is None
+            if leader:
+                call = _StreamCall()
+                self._streams[key] = call
+            call.subscribers += 1
+
+        if leader:
+            def run():
+                try:
+                    call.pump(fn(*args, abandoned=call.abandoned, **kwargs))
+                except BaseException as e:
+                    with call.cond:
+                        call.error = e
+                        call.finished = True
+                        call.cond.notify_all()
+                finally:
+                    with self._lock:
+                        if self._streams.get(key) is call:
+                            del self._streams[key]
+
+            # Run in the leader's context so its logs keep the request id
+            context = contextvars.copy_context()
+            threading.Thread(target=context.run, args=(run,), name=f"{self.name}-stream", daemon=True).start()
+        else:
+            logger.debug("%s: joining in-flight stream for %r", self.name, key)
+
+        return self._subscription(key, call, deadline, cancelled)
+
+    def _subscription(self, key, call, deadline, cancelled):
+        try:
+            yield from call.subscribe(deadline, cancelled)
+        finally:
+            with self._lock:
+                call.subscribers -= 1
+                if call.subscribers == 0 and not call.finished:
+                    call.abandoned.set()
+                    if self._streams.get(key) is call:
+                        del self._streams[key]
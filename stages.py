@@ -0,0 +1,238 @@
+"""
+Incremental outfit re-analysis over a stage dependency graph
+"""
+import json
+import hashlib
+import logging
+
+from sqlalchemy import func
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+
+from models import ClothingItem, OutfitStage
+from prompt_builder import color_name
+from llm_client import LLMOverloaded, LLMDeadlineExceeded
+
+logger = logging.getLogger(__name__)
+
+# Stage -> stages it reads from. detections and palette are the ClothingItem
+# rows written at upload; names, search and llm are derived and stored in
+# outfit_stages together with a fingerprint of their inputs.
+STAGE_DEPENDENCIES = {
+    "detections": (),
+    "palette": ("detections",),
+    "names": ("detections", "palette"),
+    "search": ("names",),
+    "llm": ("names",),
+}
+
+# Stages computed once per clothing item rather than once per outfit
+ITEM_STAGES = {"detections", "palette", "names", "search"}
+
+DEFAULT_RGB = [128, 128, 128]
+
+
+def fingerprint(value):
+    """Stable hash of a JSON-serializable stage input"""
+    encoded = json.dumps(value, sort_keys=True, default=str).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def _delete_stages(db, stage_ids):
+    """Delete stage rows by id; rows a concurrent run already removed are ignored"""
+    if stage_ids:
+        db.query(OutfitStage).filter(OutfitStage.stage_id.in_(stage_ids)).delete(synchronize_session=False)
+
+
+def downstream_stages(stage):
+    """Every stage that directly or transitively depends on stage"""
+    affected = set()
+    frontier = [stage]
+    while frontier:
+        current = frontier.pop()
+        for name, dependencies in STAGE_DEPENDENCIES.items():
+            if current in dependencies and name not in affected:
+                affected.add(name)
+                frontier.append(name)
+    return affected
+
+
+def _store_stage(db, outfit_id, stage, item_key, digest, output):
+    """
+    Write one stage output, replacing whatever row is stored for its key.
+
+    Concurrent analyses of the same outfit may both compute a stage; the
+    later write wins instead of failing on the unique constraint.
+    """
+    table = OutfitStage.__table__
+    values = {"outfit_id": outfit_id, "stage": stage, "item_key": item_key,
+              "fingerprint": digest, "output": output}
+    dialect = db.get_bind().dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+        stmt = insert(table).values(**values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["outfit_id", "stage", "item_key"],
+            set_={"fingerprint": stmt.excluded.fingerprint, "output": stmt.excluded.output,
+                  "updated_at": func.current_timestamp()}
+        )
+        db.execute(stmt)
+        return
+    # Other databases: update, else insert in a savepoint and update if another writer got there first
+    keys = (table.c.outfit_id == outfit_id, table.c.stage == stage, table.c.item_key == item_key)
+    update = table.update().where(*keys).values(fingerprint=digest, output=output)
+    if db.execute(update).rowcount:
+        return
+    try:
+        with db.begin_nested():
+            db.execute(table.insert().values(**values))
+    except IntegrityError:
+        db.execute(update)
+
+
+class IncrementalAnalyzer:
+    """
+    Compute suggestions for an outfit, reusing stored stage outputs.
+
+    Each derived stage output is stored with a fingerprint of its inputs.
+    On the next run a stage is only recomputed when its fingerprint changed,
+    so correcting one item re-runs that item's name and search stages and
+    the outfit-level LLM stage, while every other item's search is reused.
+    """
+
+    def __init__(self, ai_service, search_service):
+        self.ai_service = ai_service
+        self.search_service = search_service
+
+    def invalidate(self, db, outfit_id, stage, item_id=None):
+        """
+        Drop stored outputs downstream of a changed stage.
+
+        With item_id, per-item downstream stages are only dropped for that
+        item; outfit-level stages are always dropped.
+        """
+        affected = downstream_stages(stage)
+        rows = db.query(OutfitStage.stage_id, OutfitStage.stage, OutfitStage.item_key).filter(
+            OutfitStage.outfit_id == outfit_id,
+            OutfitStage.stage.in_(affected)
+        ).all()
+        stale = [
+            stage_id for stage_id, row_stage, item_key in rows
+            if item_id is None or row_stage not in ITEM_STAGES or item_key == str(item_id)
+        ]
+        _delete_stages(db, stale)
+        logger.info("Invalidated %s stage outputs for outfit %s after '%s' changed", len(stale), outfit_id, stage)
+        return len(stale)
+
+    def analyze(self, db, outfit_id, speculative=False, cancelled=None):
+        """
+        Run the derived stages for an outfit and return their outputs.
+
+        Stage rows are written in the caller's transaction; the caller
+        commits them along with whatever else it writes. A speculative run
+        skips the LLM stage (ai_suggestion is None) unless the model host has
+        a free slot. Setting the cancelled event abandons a running LLM stage
+        with StreamCancelled.
+        """
+        clothing_items = db.query(ClothingItem).filter(
+            ClothingItem.outfit_id == outfit_id
+        ).order_by(ClothingItem.item_id).all()
+        stored = {
+            (row.stage, row.item_key): row
+            for row in db.query(OutfitStage).filter(OutfitStage.outfit_id == outfit_id).all()
+        }
+        report = {"recomputed": [], "reused": []}
+        # Written only once every stage has run, so the transaction takes no
+        # row or table write locks while search and the LLM are in progress
+        outputs = []
+
+        def run(stage, item_key, inputs, compute):
+            """Reuse the stored output when inputs match, else compute it"""
+            digest = fingerprint(inputs)
+            label = f"{stage}:{item_key}" if item_key else stage
+            row = stored.get((stage, item_key))
+            if row is not None and row.fingerprint == digest:
+                report["reused"].append(label)
+                return row.output
+
+            output, cacheable = compute()
+            report["recomputed"].append(label)
+            if cacheable:
+                outputs.append((stage, item_key, digest, output))
+            return output
+
+        detected_items = []
+        rgb_values = []
+        similar_images = []
+        names = []
+        for item in clothing_items:
+            item_key = str(item.item_id)
+            rgb = list(item.color_palette) if item.color_palette else DEFAULT_RGB
+
+            name = run("names", item_key, {"type": item.type, "rgb": rgb},
+                       lambda: (self._names(item.type, rgb), True))
+            names.append(name)
+            similar_images.append(run("search", item_key, {"query": name["query"]},
+                                      lambda: self._search(name["query"])))
+
+            detected_items.append({
+                'type': item.type,
+                'confidence': 0.95  # Default since we don't store confidence after correction
+            })
+            rgb_values.append(rgb)
+
+        prompts = self.ai_service.prompts
+        prompt = prompts.styling_prompt(detected_items, rgb_values)
+        ai_suggestion = run(
+            "llm", "",
+            {"model": self.ai_service.model, "prompt": prompt, "options": prompts.completion_options()},
+            lambda: self._suggest(prompt, detected_items, speculative, cancelled)
+        )
+
+        for stage, item_key, digest, output in outputs:
+            _store_stage(db, outfit_id, stage, item_key, digest, output)
+
+        # Drop outputs of items that no longer exist
+        live_keys = {str(item.item_id) for item in clothing_items}
+        _delete_stages(db, [
+            row.stage_id for (stage, item_key), row in stored.items()
+            if stage in ITEM_STAGES and item_key not in live_keys
+        ])
+
+        logger.info(
+            "Outfit %s stages: %d recomputed, %d reused",
+            outfit_id, len(report["recomputed"]), len(report["reused"])
+        )
+        return {
+            "detected_items": detected_items,
+            "rgb_values": rgb_values,
+            "ai_suggestion": ai_suggestion,
+            "similar_images": similar_images,
+            "stages": report
+        }
+
+    def _names(self, item_type, rgb):
+        return {
+            "type": item_type,
+            "color": color_name(rgb),
+            "query": self.search_service.build_query(item_type, rgb)
+        }
+
+    def _search(self, query):
+        try:
+            return {"query": query, "images": self.search_service.search_images(query)}, True
+        except Exception as e:
+            # Failed searches are returned empty but not stored, so they retry next time
+            logger.warning("Search failed for query '%s': %s", query, e)
+            return {"query": query, "images": []}, False
+
+    def _suggest(self, prompt, detected_items, speculative=False, cancelled=None):
+        if speculative and not self.ai_service.llm.has_capacity():
+            logger.info("LLM host busy, skipping speculative suggestion")
+            return None, False
+        try:
+            return self.ai_service.chat_with_chatgpt(prompt, cancelled), True
+        except (LLMOverloaded, LLMDeadlineExceeded) as e:
+            # Fallback advice is served but never stored as the stage output
+            logger.warning("Serving fallback styling suggestions: %s", e)
+            return self.ai_service.fallback_suggestions(detected_items), False
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Minimal OpenAI-compatible stub server for exercising LLMClient locally.
+
+Run it, then point the backend at it:
+
+    python stub_llm_server.py --port 11435 --token-delay 0.2
+    OLLAMA_BASE_URL=http://localhost:11435/v1 LLM_MAX_QUEUE=2 python main.py
+
+Slow token delays make it easy to observe queueing, load shedding and
+deadline handling without a real model host.
+"""
+
+import argparse
+import json
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+REPLY = "Vibe: 7/10. Add a leather belt and a watch. Tip: roll the sleeves once for a relaxed fit."
+
+
+def make_handler(token_delay):
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(length) or b"{}")
+            if not self.path.endswith("/chat/completions"):
+                self.send_error(404)
+                return
+
+            tokens = [word + " " for word in REPLY.split(" ")]
+            max_tokens = body.get("max_tokens")
+            if max_tokens:
+                tokens = tokens[:max_tokens]
+
+            if not body.get("stream"):
+                payload = json.dumps({
+                    "id": "stub",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": body.get("model", "stub"),
+                    "choices": [{
+                        "index": 0,
+                        "message": {"role": "assistant", "content": "".join(tokens)},
+                        "finish_reason": "stop",
+                    }],
+                }).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for token in tokens:
+                time.sleep(token_delay)
+                self._send_event({
+                    "id": "stub",
+                    "object": "chat.completion.chunk",
+                    "created": int(time.time()),
+                    "model": body.get("model", "stub"),
+                    "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}],
+                })
+            self._send_chunk(b"data: [DONE]\n\n")
+            self._send_chunk(b"")
+
+        def _send_event(self, data):
+            self._send_chunk(f"data: {json.dumps(data)}\n\n".encode("utf-8"))
+
+        def _send_chunk(self, data):
+            self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+            self.wfile.flush()
+
+    return StubHandler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--token-delay", type=float, default=0.05)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), make_handler(args.token_delay))
+    print(f"Stub LLM server listening on http://127.0.0.1:{args.port}/v1")
+    server.serve_forever()
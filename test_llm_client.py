@@ -0,0 +1,91 @@
+"""Tests for LLM slot queueing and cancellation"""
+import time
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from ai_service import AIService
+from llm_client import LLMClient, LLMCancelled
+from singleflight import StreamCancelled
+
+
+def refuse_requests(client):
+    def create(**kwargs):
+        pytest.fail("request sent for a cancelled generation")
+
+    client.client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+
+
+def make_client(**kwargs):
+    # Nothing listens on the discard port; these tests never reach the host
+    return LLMClient(base_url="http://127.0.0.1:9/v1", max_concurrency=1, max_queue=1, timeout=30, **kwargs)
+
+
+def wait_for(predicate, timeout=5):
+    until = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < until, "condition not reached"
+        time.sleep(0.01)
+
+
+def test_cancelled_waiter_leaves_the_slot_queue():
+    client = make_client()
+    cancelled = threading.Event()
+    outcome = {}
+
+    def queue_for_slot():
+        try:
+            with client.slot(cancelled=cancelled):
+                outcome["acquired"] = True
+        except LLMCancelled as e:
+            outcome["error"] = e
+
+    with client.slot():
+        waiter = threading.Thread(target=queue_for_slot)
+        waiter.start()
+        wait_for(lambda: client.metrics.queued == 1)
+        cancelled.set()
+        waiter.join(5)
+        assert not waiter.is_alive()
+        assert isinstance(outcome.get("error"), LLMCancelled)
+        # Its queue place is free again while the slot is still held
+        assert client._pending == 1
+    assert client._pending == 0
+    assert client.metrics.snapshot()["cancelled"] == 1
+
+
+def test_cancelled_generation_is_never_sent():
+    client = make_client()
+    refuse_requests(client)
+    cancelled = threading.Event()
+    cancelled.set()
+    with pytest.raises(LLMCancelled):
+        list(client.stream_chat([{"role": "user", "content": "hi"}], cancelled=cancelled))
+    assert client._pending == 0
+
+
+def test_cancelled_speculative_generation_gives_up_its_queue_place():
+    client = make_client()
+    refuse_requests(client)
+    ai = AIService(llm=client)
+    cancelled = threading.Event()
+    outcome = {}
+
+    def speculate():
+        try:
+            ai.chat_with_chatgpt("style this outfit", cancelled)
+        except StreamCancelled as e:
+            outcome["error"] = e
+
+    with client.slot():
+        speculative = threading.Thread(target=speculate)
+        speculative.start()
+        wait_for(lambda: client.metrics.queued == 1)
+        # Cancelled before its first chunk, while still queued for a slot
+        cancelled.set()
+        speculative.join(5)
+        assert isinstance(outcome.get("error"), StreamCancelled)
+        wait_for(lambda: client._pending == 1)
+    assert client.metrics.snapshot()["cancelled"] == 1
+    assert client.metrics.snapshot()["requests"] == 0
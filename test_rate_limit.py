@@ -0,0 +1,75 @@
+"""Tests for token buckets and stage concurrency limits"""
+import pytest
+
+import rate_limit
+from rate_limit import MemoryBucketStore, RateLimiter, StageLimiter
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(rate_limit.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_burst_then_wait_for_refill(clock):
+    store = MemoryBucketStore()
+    rate, burst = 1.0, 3  # one token per second
+    assert [store.take("u", rate, burst) for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert store.take("u", rate, burst) == pytest.approx(1.0)
+
+    clock[0] += 0.25
+    # The refused request spent nothing; a quarter token has refilled since
+    assert store.take("u", rate, burst) == pytest.approx(0.75)
+    clock[0] += 0.75
+    assert store.take("u", rate, burst) == 0.0
+
+
+def test_refill_is_capped_at_burst(clock):
+    store = MemoryBucketStore()
+    for _ in range(2):
+        store.take("u", 1.0, 2)
+    clock[0] += 3600
+    assert [store.take("u", 1.0, 2) for _ in range(3)] == [0.0, 0.0, pytest.approx(1.0)]
+
+
+def test_cost_larger_than_tokens_left(clock):
+    store = MemoryBucketStore()
+    assert store.take("u", 0.5, 4, cost=3) == 0.0
+    # One token left; two more take four seconds at half a token per second
+    assert store.take("u", 0.5, 4, cost=3) == pytest.approx(4.0)
+
+
+def test_keys_are_independent_and_bounded(clock):
+    store = MemoryBucketStore(max_keys=2)
+    store.take("a", 1.0, 1)
+    store.take("b", 1.0, 1)
+    assert store.take("a", 1.0, 1) > 0
+    store.take("c", 1.0, 1)
+    # "b" was least recently used and has been evicted with its empty bucket
+    assert store.take("b", 1.0, 1) == 0.0
+    assert len(store._buckets) == 2
+
+
+def test_rate_limiter_disabled_at_zero(clock):
+    limiter = RateLimiter(per_minute=0, burst=1, store=MemoryBucketStore())
+    assert not limiter.enabled
+    assert all(limiter.check("u") == 0.0 for _ in range(10))
+
+
+def test_rate_limiter_admits_when_store_fails(clock):
+    class Broken:
+        def take(self, *args):
+            raise ConnectionError("store down")
+
+    assert RateLimiter(per_minute=60, burst=1, store=Broken()).check("u") == 0.0
+
+
+def test_stage_limiter_rejects_when_saturated():
+    limiter = StageLimiter("detection", 1, queue_timeout=0.01)
+    assert limiter.acquire()
+    assert not limiter.acquire()
+    assert limiter.rejected == 1
+    limiter.release()
+    assert limiter.acquire()
+    limiter.release()
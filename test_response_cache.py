@@ -0,0 +1,90 @@
+"""Tests for the versioned, byte-bounded response cache"""
+import response_cache
+from response_cache import ResponseCache, etag_matches
+
+
+class Renderer:
+    """render() callable that counts how often it ran"""
+
+    def __init__(self, body="<html>page</html>"):
+        self.body = body
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.body
+
+
+def test_hit_for_the_same_version():
+    cache = ResponseCache(max_entries=8, max_bytes=1024, ttl=0)
+    render = Renderer()
+    first = cache.get_or_render("results", 1, 1, render)
+    second = cache.get_or_render("results", 1, 1, render)
+    assert render.calls == 1
+    assert second is first
+    assert first.body == b"<html>page</html>"
+
+
+def test_version_mismatch_renders_again():
+    cache = ResponseCache(max_entries=8, max_bytes=1024, ttl=0)
+    old = cache.get_or_render("results", 1, 1, Renderer("old"))
+    new = cache.get_or_render("results", 1, 2, Renderer("new"))
+    assert new.body == b"new"
+    assert new.etag != old.etag
+    # A slow render for the older version must not replace the newer entry
+    cache.get_or_render("results", 1, 1, Renderer("stale"))
+    render = Renderer("unused")
+    assert cache.get_or_render("results", 1, 2, render).body == b"new"
+    assert render.calls == 0
+
+
+def test_evicts_least_recently_used_by_bytes():
+    cache = ResponseCache(max_entries=8, max_bytes=10, ttl=0)
+    cache.get_or_render("outfit", 1, 1, Renderer("aaaa"))
+    cache.get_or_render("outfit", 2, 1, Renderer("bbbb"))
+    cache.get_or_render("outfit", 1, 1, Renderer("unused"))  # 1 is now most recent
+    cache.get_or_render("outfit", 3, 1, Renderer("cccc"))
+    assert cache.stats()["bytes"] == 8
+    assert cache.stats()["entries"] == 2
+
+    render = Renderer("bbbb")
+    cache.get_or_render("outfit", 2, 1, render)
+    assert render.calls == 1
+
+
+def test_body_larger_than_the_cache_is_not_stored():
+    cache = ResponseCache(max_entries=8, max_bytes=4, ttl=0)
+    assert cache.get_or_render("outfit", 1, 1, Renderer("too large")).body == b"too large"
+    assert cache.stats() == {"entries": 0, "bytes": 0, "hits": 0, "misses": 1}
+
+
+def test_hits_restart_the_ttl(monkeypatch):
+    clock = [100.0]
+    monkeypatch.setattr(response_cache.time, "monotonic", lambda: clock[0])
+    cache = ResponseCache(max_entries=8, max_bytes=1024, ttl=30)
+    render = Renderer()
+    cache.get_or_render("results", 1, 1, render)
+    for _ in range(3):
+        clock[0] += 20
+        cache.get_or_render("results", 1, 1, render)
+    assert render.calls == 1
+    clock[0] += 31
+    cache.get_or_render("results", 1, 1, render)
+    assert render.calls == 2
+
+
+def test_invalidate_drops_every_kind_for_the_outfit():
+    cache = ResponseCache(max_entries=8, max_bytes=1024, ttl=0)
+    cache.get_or_render("results", 1, 1, Renderer())
+    cache.get_or_render("outfit", 1, 1, Renderer())
+    cache.get_or_render("outfit", 2, 1, Renderer())
+    cache.invalidate(1)
+    assert cache.stats()["entries"] == 1
+
+
+def test_etag_matches():
+    assert etag_matches('"abc"', '"abc"')
+    assert etag_matches('W/"abc", "def"', '"abc"')
+    assert etag_matches("*", '"abc"')
+    assert not etag_matches('"def"', '"abc"')
+    assert not etag_matches(None, '"abc"')
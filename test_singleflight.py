@@ -0,0 +1,271 @@
+"""Tests for single-flight call and stream coalescing"""
+import time
+import threading
+
+import pytest
+
+import singleflight
+from singleflight import SingleFlight
+
+
+class Gate:
+    """Iterator that yields chunks only as the test releases them"""
+
+    def __init__(self):
+        self.chunks = []
+        self.cond = threading.Condition()
+        self.error = None
+        self.closed = False
+
+    def push(self, chunk):
+        with self.cond:
+            self.chunks.append(chunk)
+            self.cond.notify_all()
+
+    def fail(self, error):
+        with self.cond:
+            self.error = error
+            self.cond.notify_all()
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+    def __iter__(self):
+        index = 0
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: index < len(self.chunks) or self.error or self.closed, timeout=5)
+                if index < len(self.chunks):
+                    chunk = self.chunks[index]
+                elif self.error is not None:
+                    raise self.error
+                else:
+                    return
+            index += 1
+            yield chunk
+
+
+def run_in_thread(fn):
+    """Start fn on a thread; returns (thread, outcome dict)"""
+    outcome = {}
+
+    def target():
+        try:
+            outcome["result"] = fn()
+        except BaseException as e:
+            outcome["error"] = e
+
+    thread = threading.Thread(target=target)
+    thread.start()
+    return thread, outcome
+
+
+class CountingEvent(threading.Event):
+    """Event that counts threads blocked in wait()"""
+
+    def __init__(self):
+        super().__init__()
+        self.waiters = threading.Semaphore(0)
+
+    def wait(self, timeout=None):
+        self.waiters.release()
+        return super().wait(timeout)
+
+
+def test_do_shares_leader_error_with_every_waiter(monkeypatch):
+    events = []
+
+    class TrackedCall(singleflight._Call):
+        def __init__(self):
+            super().__init__()
+            self.done = CountingEvent()
+            events.append(self.done)
+
+    monkeypatch.setattr(singleflight, "_Call", TrackedCall)
+    flight = SingleFlight("test")
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def fail():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        raise RuntimeError("upstream down")
+
+    leader = run_in_thread(lambda: flight.do("key", fail))
+    assert started.wait(5)
+    followers = [run_in_thread(lambda: flight.do("key", fail)) for _ in range(3)]
+    # Fail only once every follower is parked on the in-flight call
+    for _ in followers:
+        assert events[0].waiters.acquire(timeout=5)
+    release.set()
+
+    for thread, outcome in [leader] + followers:
+        thread.join(5)
+        assert isinstance(outcome.get("error"), RuntimeError)
+    assert len(calls) == 1
+
+
+def test_do_releases_key_after_completion():
+    flight = SingleFlight("test")
+    calls = []
+
+    def work():
+        calls.append(1)
+        return len(calls)
+
+    assert flight.do("key", work) == 1
+    assert flight.do("key", work) == 2
+    assert flight._calls == {}
+
+    with pytest.raises(ValueError):
+        flight.do("key", lambda: (_ for _ in ()).throw(ValueError("boom")))
+    assert flight._calls == {}
+
+
+def test_stream_leader_error_reaches_every_subscriber():
+    flight = SingleFlight("test")
+    upstream = Gate()
+    starts = []
+
+    def open_stream(abandoned):
+        starts.append(1)
+        return iter(upstream)
+
+    subscribers = [flight.stream("key", open_stream) for _ in range(3)]
+    upstream.push("a")
+    upstream.fail(RuntimeError("generation failed"))
+
+    for subscriber in subscribers:
+        received = []
+        with pytest.raises(RuntimeError, match="generation failed"):
+            for chunk in subscriber:
+                received.append(chunk)
+        assert received == ["a"]
+    assert len(starts) == 1
+
+
+def test_stream_error_opening_upstream_reaches_subscribers():
+    flight = SingleFlight("test")
+
+    def open_stream(abandoned):
+        raise ConnectionError("refused")
+
+    with pytest.raises(ConnectionError):
+        list(flight.stream("key", open_stream))
+
+
+def test_stream_late_joiner_replays_from_first_chunk():
+    flight = SingleFlight("test")
+    upstream = Gate()
+
+    first = flight.stream("key", lambda abandoned: iter(upstream))
+    upstream.push("a")
+    upstream.push("b")
+    assert next(first) == "a"
+    assert next(first) == "b"
+
+    # Joins after two chunks were already produced
+    late = flight.stream("key", lambda abandoned: pytest.fail("second upstream opened"))
+    upstream.push("c")
+    upstream.close()
+
+    assert list(first) == ["c"]
+    assert list(late) == ["a", "b", "c"]
+
+
+def test_stream_releases_key_after_completion():
+    flight = SingleFlight("test")
+    starts = []
+
+    def open_stream(abandoned):
+        starts.append(1)
+        return iter(["x", "y"])
+
+    assert list(flight.stream("key", open_stream)) == ["x", "y"]
+    # The pump thread drops the key just after it marks the stream finished
+    for thread in threading.enumerate():
+        if thread.name == "test-stream":
+            thread.join(5)
+    assert flight._streams == {}
+    assert list(flight.stream("key", open_stream)) == ["x", "y"]
+    assert len(starts) == 2
+
+
+def test_stream_subscriber_deadline_does_not_end_shared_stream():
+    flight = SingleFlight("test")
+    upstream = Gate()
+
+    impatient = flight.stream("key", lambda abandoned: iter(upstream), deadline=time.monotonic() + 0.05)
+    patient = flight.stream("key", lambda abandoned: pytest.fail("second upstream opened"))
+    with pytest.raises(TimeoutError):
+        next(impatient)
+
+    upstream.push("a")
+    upstream.close()
+    assert list(patient) == ["a"]
+
+
+def test_stream_closes_upstream_once_every_subscriber_cancelled():
+    flight = SingleFlight("test")
+    upstream = Gate()
+    closed = threading.Event()
+
+    def open_stream(abandoned):
+        try:
+            yield from upstream
+        finally:
+            closed.set()
+
+    cancelled = threading.Event()
+    subscribers = [flight.stream("key", open_stream, cancelled=cancelled) for _ in range(2)]
+    upstream.push("a")
+    assert next(subscribers[0]) == "a"
+    cancelled.set()
+    for subscriber in subscribers:
+        with pytest.raises(singleflight.StreamCancelled):
+            list(subscriber)
+    # The key is free at once; the upstream closes at its next chunk
+    assert flight._streams == {}
+    upstream.push("b")
+    assert closed.wait(5)
+
+
+def test_stream_keeps_upstream_for_remaining_subscriber():
+    flight = SingleFlight("test")
+    upstream = Gate()
+
+    cancelled = threading.Event()
+    speculative = flight.stream("key", lambda abandoned: iter(upstream), cancelled=cancelled)
+    real = flight.stream("key", lambda abandoned: pytest.fail("second upstream opened"))
+    cancelled.set()
+    with pytest.raises(singleflight.StreamCancelled):
+        next(speculative)
+
+    upstream.push("a")
+    upstream.push("b")
+    upstream.close()
+    assert list(real) == ["a", "b"]
+
+
+def test_stream_cancelled_before_first_chunk_abandons_upstream():
+    flight = SingleFlight("test")
+    upstream = Gate()
+    events = []
+
+    def open_stream(abandoned):
+        # Like a generation still queued for a model slot
+        events.append(abandoned)
+        return iter(upstream)
+
+    cancelled = threading.Event()
+    subscriber = flight.stream("key", open_stream, cancelled=cancelled)
+    thread, outcome = run_in_thread(lambda: list(subscriber))
+    cancelled.set()
+    thread.join(5)
+    assert isinstance(outcome.get("error"), singleflight.StreamCancelled)
+    assert flight._streams == {}
+    assert events[0].is_set()
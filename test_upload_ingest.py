@@ -0,0 +1,142 @@
+"""Tests for bounded upload parsing and zip expansion"""
+import io
+import zipfile
+
+import pytest
+
+from pipeline import BadRequest
+from upload_ingest import (MultipartUpload, UploadBuffer, PayloadTooLarge, UnsupportedMediaType,
+                           check_content_length)
+from batch_service import iter_uploaded_images
+
+BOUNDARY = "testboundary"
+CONTENT_TYPE = f"multipart/form-data; boundary={BOUNDARY}"
+PNG = b"\x89PNG\r\n\x1a\n" + bytes(range(256)) * 4
+
+
+def multipart(*parts):
+    """Encode (name, value, filename) parts as a multipart/form-data body"""
+    body = b""
+    for name, value, filename in parts:
+        disposition = f'form-data; name="{name}"'
+        if filename is not None:
+            disposition += f'; filename="{filename}"'
+        body += f"--{BOUNDARY}\r\nContent-Disposition: {disposition}\r\n\r\n".encode() + value + b"\r\n"
+    return body + f"--{BOUNDARY}--\r\n".encode()
+
+
+def parse(body, chunk_size=7, **kwargs):
+    upload = MultipartUpload(CONTENT_TYPE, str(len(body)), **kwargs)
+    for start in range(0, len(body), chunk_size):
+        upload.feed(body[start:start + chunk_size])
+    return upload, upload.finish()
+
+
+def test_file_and_fields_arrive_in_small_chunks():
+    upload, data = parse(multipart(("user_id", b"7", None), ("file", PNG, "a.png")))
+    assert bytes(data) == PNG
+    assert upload.fields == {"user_id": "7"}
+    assert upload.file.media_type == "image/png"
+
+
+def test_image_over_the_limit_is_413():
+    with pytest.raises(PayloadTooLarge) as excinfo:
+        parse(multipart(("file", PNG, "a.png")), max_bytes=len(PNG) - 1)
+    assert excinfo.value.status_code == 413
+
+
+def test_body_over_the_limit_is_413_without_a_file():
+    fields = [(f"f{i}", b"x" * 100, None) for i in range(50)]
+    with pytest.raises(PayloadTooLarge):
+        parse(multipart(*fields), max_body_bytes=1024)
+
+
+def test_content_length_over_the_limit_is_413():
+    with pytest.raises(PayloadTooLarge):
+        check_content_length("2048", 1024)
+    check_content_length("1024", 1024)
+    check_content_length("not a number", 1024)
+    check_content_length(None, 1024)
+
+
+def test_non_image_magic_number_is_415():
+    with pytest.raises(UnsupportedMediaType) as excinfo:
+        parse(multipart(("file", b"%PDF-1.7\n" + b"x" * 64, "a.png")))
+    assert excinfo.value.status_code == 415
+
+
+def test_short_non_image_is_415_at_finish():
+    with pytest.raises(UnsupportedMediaType):
+        parse(multipart(("file", b"GIF", "a.gif")))
+
+
+def test_second_file_part_is_rejected():
+    with pytest.raises(BadRequest, match="Only one file"):
+        parse(multipart(("file", PNG, "a.png"), ("file", PNG, "b.png")))
+
+
+def test_oversized_text_field_is_413():
+    with pytest.raises(PayloadTooLarge, match="username"):
+        parse(multipart(("username", b"u" * 5000, None), ("file", PNG, "a.png")))
+
+
+def test_missing_boundary_is_rejected():
+    with pytest.raises(BadRequest):
+        MultipartUpload("multipart/form-data")
+    with pytest.raises(BadRequest):
+        MultipartUpload(None)
+
+
+def test_missing_file_is_rejected():
+    with pytest.raises(BadRequest, match="No file"):
+        parse(multipart(("user_id", b"7", None)))
+
+
+def test_upload_buffer_grows_to_its_cap():
+    buffer = UploadBuffer(max_bytes=len(PNG), size_hint=8)
+    buffer.write(PNG[:100])
+    buffer.write(PNG[100:])
+    assert bytes(buffer.getbuffer()) == PNG
+    with pytest.raises(PayloadTooLarge):
+        buffer.write(b"x")
+    with pytest.raises(PayloadTooLarge):
+        UploadBuffer(max_bytes=10, size_hint=11)
+
+
+def zip_of(members):
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED) as z:
+        for name, data in members.items():
+            z.writestr(name, data)
+    archive.seek(0)
+    return archive
+
+
+def test_zip_members_are_expanded_in_order():
+    archive = zip_of({"a.png": PNG, "notes.txt": b"skip", "dir/b.jpg": b"jpeg"})
+    images = list(iter_uploaded_images([("photos.zip", archive), (None, io.BytesIO(b"raw"))], 10_000, 100_000))
+    assert images == [("a.png", PNG), ("dir/b.jpg", b"jpeg"), ("upload", b"raw")]
+
+
+def test_zip_member_larger_than_the_image_cap_is_refused():
+    # Compresses to a few hundred bytes, expands past the cap
+    archive = zip_of({"bomb.png": b"\0" * 1_000_000})
+    with pytest.raises(ValueError, match="bomb.png"):
+        list(iter_uploaded_images([("photos.zip", archive)], 100_000, 10_000_000))
+
+
+def test_zip_members_past_the_total_cap_are_refused():
+    archive = zip_of({f"{i}.png": b"\0" * 1000 for i in range(5)})
+    images = iter_uploaded_images([("photos.zip", archive)], 1000, 2500)
+    assert next(images)[0] == "0.png"
+    assert next(images)[0] == "1.png"
+    with pytest.raises(ValueError, match="exceed"):
+        next(images)
+
+
+def test_plain_files_past_the_total_cap_are_refused():
+    uploads = [("a.png", io.BytesIO(b"x" * 600)), ("b.png", io.BytesIO(b"x" * 600))]
+    images = iter_uploaded_images(uploads, 1000, 1000)
+    next(images)
+    with pytest.raises(ValueError):
+        next(images)
@@ -0,0 +1,193 @@
+"""
+Bounded ingestion of uploaded image bodies.
+
+Upload bodies are parsed as they stream in; the image part goes chunk by
+chunk into one preallocated buffer and is handed to decoding as a memoryview, so a request holds at most MAX_UPLOAD_BYTES of
+image data and nothing is copied after it arrives. Oversized bodies (413)
+and non-image content, detected from magic bytes (415), are refused as soon
+as they are seen.
+
+    MAX_UPLOAD_BYTES        largest single image (default 20 MB)
+    MAX_BATCH_UPLOAD_BYTES  largest /upload/batch request body (default 512 MB)
+"""
+import os
+import logging
+
+from image_store import image_media_type
+from pipeline import PipelineError, BadRequest
+
+logger = logging.getLogger(__name__)
+
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(20 * 1024 * 1024)))
+MAX_BATCH_UPLOAD_BYTES = int(os.getenv("MAX_BATCH_UPLOAD_BYTES", str(512 * 1024 * 1024)))
+# Room for the form fields and part headers around the file in a multipart body
+MULTIPART_OVERHEAD = 64 * 1024
+CHUNK_SIZE = 64 * 1024
+INITIAL_BUFFER_SIZE = 256 * 1024
+# Enough leading bytes for every signature image_media_type knows
+MAGIC_BYTES = 16
+
+
+class PayloadTooLarge(PipelineError):
+    status_code = 413
+
+
+class UnsupportedMediaType(PipelineError):
+    status_code = 415
+
+
+def check_content_length(content_length, limit):
+    """Refuse a request from its Content-Length header before reading the body"""
+    try:
+        if content_length is not None and int(content_length) > limit:
+            raise PayloadTooLarge(f"Upload exceeds {limit} bytes")
+    except ValueError:
+        pass
+
+
+class UploadBuffer:
+    """
+    Growable buffer with a hard size cap for one uploaded image.
+
+    Preallocated from the request's Content-Length when known; write()
+    chunks as they arrive, then take getbuffer().
+    """
+
+    def __init__(self, max_bytes=None, size_hint=None):
+        self.max_bytes = max_bytes or MAX_UPLOAD_BYTES
+        if size_hint is not None and size_hint > self.max_bytes:
+            raise PayloadTooLarge(f"Image exceeds {self.max_bytes} bytes")
+        self._buf = bytearray(min(size_hint or INITIAL_BUFFER_SIZE, self.max_bytes))
+        self.size = 0
+        self.media_type = None
+
+    def _reserve(self, needed):
+        """Make room for needed bytes in total, growing geometrically up to the cap"""
+        if needed > self.max_bytes:
+            raise PayloadTooLarge(f"Image exceeds {self.max_bytes} bytes")
+        if needed > len(self._buf):
+            self._buf.extend(bytes(min(max(needed, 2 * len(self._buf)), self.max_bytes) - len(self._buf)))
+
+    def _sniff(self):
+        if self.media_type is None and self.size >= MAGIC_BYTES:
+            self._check_type()
+
+    def _check_type(self):
+        self.media_type = image_media_type(bytes(self._buf[:MAGIC_BYTES]))
+        if self.media_type is None:
+            raise UnsupportedMediaType("File must be a JPEG, PNG, GIF, BMP or WebP image")
+
+    def write(self, chunk):
+        end = self.size + len(chunk)
+        self._reserve(end)
+        self._buf[self.size:end] = chunk
+        self.size = end
+        self._sniff()
+
+    def getbuffer(self):
+        """The uploaded bytes as a zero-copy memoryview"""
+        if self.media_type is None:
+            self._check_type()
+        return memoryview(self._buf)[:self.size]
+
+
+class MultipartUpload:
+    """
+    Push-style multipart/form-data reader for a single-image upload.
+
+    feed() it body chunks as they arrive from the network; the part named
+    file_field goes straight into an UploadBuffer and other parts are kept
+    as small text fields. Nothing is spooled to disk.
+    """
+
+    def __init__(self, content_type, content_length=None, file_field="file", max_bytes=None,
+                 max_field_bytes=4096, max_body_bytes=None):
+        try:
+            from python_multipart.multipart import MultipartParser, parse_options_header
+        except ImportError:
+            from multipart.multipart import MultipartParser, parse_options_header
+
+        _, params = parse_options_header(content_type or "")
+        boundary = params.get(b"boundary")
+        if not boundary:
+            raise BadRequest("Expected a multipart/form-data body")
+
+        self.file_field = file_field
+        self.max_field_bytes = max_field_bytes
+        self.fields = {}
+        self.file = None
+        self._parse_options_header = parse_options_header
+        self._max_bytes = max_bytes or MAX_UPLOAD_BYTES
+        # Bounds the whole body too, so any number of small fields cannot grow it
+        self._max_body_bytes = max_body_bytes or self._max_bytes + MULTIPART_OVERHEAD
+        self._received = 0
+        try:
+            # The body is only slightly larger than the file it carries
+            self._size_hint = min(int(content_length), self._max_bytes) if content_length else None
+        except ValueError:
+            self._size_hint = None
+        self._header_field = b""
+        self._header_value = b""
+        self._part_headers = {}
+        self._part_name = None
+        self._part_value = None
+        self._parser = MultipartParser(boundary, {
+            "on_part_begin": self._on_part_begin,
+            "on_part_data": self._on_part_data,
+            "on_part_end": self._on_part_end,
+            "on_header_field": self._on_header_field,
+            "on_header_value": self._on_header_value,
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": self._on_headers_finished,
+        })
+
+    def _on_part_begin(self):
+        self._part_headers = {}
+        self._part_name = None
+        self._part_value = None
+
+    def _on_header_field(self, data, start, end):
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data, start, end):
+        self._header_value += data[start:end]
+
+    def _on_header_end(self):
+        self._part_headers[self._header_field.lower()] = self._header_value
+        self._header_field = b""
+        self._header_value = b""
+
+    def _on_headers_finished(self):
+        _, params = self._parse_options_header(self._part_headers.get(b"content-disposition", b""))
+        self._part_name = params.get(b"name", b"").decode("utf-8", "replace")
+        if self._part_name == self.file_field and b"filename" in params:
+            if self.file is not None:
+                raise BadRequest("Only one file may be uploaded")
+            self.file = UploadBuffer(self._max_bytes, self._size_hint)
+        else:
+            self._part_value = bytearray()
+
+    def _on_part_data(self, data, start, end):
+        if self._part_value is None:
+            self.file.write(memoryview(data)[start:end])
+        else:
+            self._part_value += data[start:end]
+            if len(self._part_value) > self.max_field_bytes:
+                raise PayloadTooLarge(f"Form field '{self._part_name}' is too large")
+
+    def _on_part_end(self):
+        if self._part_value is not None:
+            self.fields[self._part_name] = self._part_value.decode("utf-8", "replace")
+
+    def feed(self, chunk):
+        self._received += len(chunk)
+        if self._received > self._max_body_bytes:
+            raise PayloadTooLarge(f"Upload exceeds {self._max_body_bytes} bytes")
+        self._parser.write(chunk)
+
+    def finish(self):
+        """Complete parsing; returns the uploaded image as a memoryview"""
+        self._parser.finalize()
+        if self.file is None:
+            raise BadRequest("No file provided")
+        return self.file.getbuffer()
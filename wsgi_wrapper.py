@@ -1,37 +1,12 @@
 """
-WSGI wrapper for FastAPI app to work with Gunicorn
-"""
-from app import app as fastapi_app
-from fastapi.applications import FastAPI
-import logging
+WSGI entry point for servers that cannot host ASGI apps.
 
-# Create a WSGI-compatible wrapper
-def application(environ, start_response):
-    """WSGI application wrapper for FastAPI"""
-    try:
-        # Simple fallback - redirect to proper ASGI setup
-        status = '500 Internal Server Error'
-        headers = [('Content-Type', 'text/html')]
-        start_response(status, headers)
-        
-        message = """
-        <html>
-        <head><title>Configuration Error</title></head>
-        <body>
-        <h1>FastAPI Configuration Issue</h1>
-        <p>This FastAPI application needs to be run with an ASGI server like Uvicorn, not Gunicorn WSGI.</p>
-        <p>Please run: <code>python main.py</code> or <code>uvicorn main:app --host 0.0.0.0 --port 5000</code></p>
-        <p>For now, attempting to start Uvicorn programmatically...</p>
-        </body>
-        </html>
-        """
-        return [message.encode('utf-8')]
-    except Exception as e:
-        logging.error(f"WSGI wrapper error: {e}")
-        status = '500 Internal Server Error'
-        headers = [('Content-Type', 'text/plain')]
-        start_response(status, headers)
-        return [f"Error: {str(e)}".encode('utf-8')]
+Serves the Flask adapter over the same pipeline as the FastAPI app, so
+plain WSGI deployments (e.g. gunicorn wsgi_wrapper:app with sync workers)
+behave the same. The supported production entry point is the ASGI app in
+main.py; see gunicorn.conf.py.
+"""
+from flask_app import app as application
 
 # For Gunicorn compatibility
-app = application
\ No newline at end of file
+app = application